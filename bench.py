@@ -0,0 +1,417 @@
+# (c) Toshiaki Koike-Akino, 2022
+# benchmarks for qusic; inference, training step, synthesis, render, end-to-end concert, gradient and startup time,
+# and time to target loss per optimizer
+# results dumped as baseline json; later runs compared against it to catch regressions
+import argparse
+import contextlib
+import subprocess
+import platform
+import tempfile
+import tracemalloc
+import json
+import io
+import sys
+import time
+import os
+import numpy as np
+import qusic
+
+# args
+def get_args():
+    parser = argparse.ArgumentParser(__file__)
+    # general
+    parser.add_argument('--verb', action='store_true', help='verbose')
+    parser.add_argument('--seed', default=1, type=int, help='seed for main')
+
+    # bench args
+    bench_args(parser)
+
+    return parser.parse_args()
+
+# bench args
+def bench_args(parser):
+    parser = parser.add_argument_group('bench')
+    parser.add_argument('--bench', default=['call', 'step', 'generate', 'synthesize', 'concert'],
+                        choices=['call', 'step', 'generate', 'synthesize', 'concert', 'grad', 'startup', 'scale',
+                                 'target', 'teach', 'live'],
+                        type=str, nargs='+', help='benchmarks to run')
+    parser.add_argument('--ansatzes', default=['BasicEntanglerLayers', 'StronglyEntanglingLayers', 'RandomLayers'],
+                        type=str, nargs='+', help='ansatzes to benchmark')
+    parser.add_argument('--depths', default=[1, 2, 7, 32, 64], type=int, nargs='+', help='ansatz layers')
+    parser.add_argument('--num-wires', default=[3, 5, 7], type=int, nargs='+',
+                        help='qubit counts for call benchmark (leading notes of --wires)')
+    parser.add_argument('--methods', default=['backprop', 'adjoint', 'parameter-shift'],
+                        type=str, nargs='+', help='differentiation methods')
+    parser.add_argument('--wires', default=['C', 'D', 'E', 'F', 'G', 'A', 'B'],
+                        type=str, nargs='+', help='qubit wires')
+    parser.add_argument('--repeat', default=3, type=int, help='repetitions per measurement (best taken)')
+    parser.add_argument('--entries', default=['qusic', 'qoncert', 'chord', 'qaestro', 'synth', 'twinkle'],
+                        type=str, nargs='+', help='entry points for startup benchmark')
+    parser.add_argument('--opts', default=['AdamOptimizer', 'AdagradOptimizer', 'GradientDescentOptimizer',
+                                           'MomentumOptimizer', 'NesterovMomentumOptimizer', 'RMSPropOptimizer',
+                                           'QNGOptimizer'],
+                        type=str, nargs='+', help='optimizers for step benchmark')
+    parser.add_argument('--sounds', default=['piano', 'organ', 'acoustic', 'edm'],
+                        type=str, nargs='+', help='instruments for generate benchmark')
+    parser.add_argument('--arpes', default=['rand', 'down', 'up', 'cap', 'cup'],
+                        type=str, nargs='+', help='arpeggio styles for synthesize benchmark')
+    parser.add_argument('--sims', default=['statevector', 'lightcone'], type=str, nargs='+',
+                        help='simulations for scale benchmark')
+    parser.add_argument('--scale-wires', default=[7, 12, 16, 20, 24, 36], type=int, nargs='+',
+                        help='keyboard sizes for scale benchmark (semitones from C3)')
+    parser.add_argument('--max-qubits', default=20, type=int,
+                        help='largest statevector (or light cone) simulated in scale benchmark')
+    parser.add_argument('--target-opts', default=['AdamOptimizer', 'RotosolveOptimizer'], type=str, nargs='+',
+                        help='optimizers for target benchmark (full-batch teaching of qaestro defaults)')
+    parser.add_argument('--target-loss', default=0.61, type=float, help='validation bce to reach in target benchmark')
+    parser.add_argument('--target-lr', default=0.1, type=float, help='learning rate in target benchmark')
+    parser.add_argument('--max-epochs', default=300, type=int, help='epoch limit in target benchmark')
+    parser.add_argument('--teach-wires', default=[7, 12], type=int, nargs='+',
+                        help='chromatic keyboard sizes (from C, at most 12) for teach benchmark; fails if not teachable')
+    parser.add_argument('--teach-epochs', default=5, type=int, help='epochs per teach benchmark run')
+    parser.add_argument('--baseline', default=None, type=str, help='write results as baseline json')
+    parser.add_argument('--compare', default=None, type=str, help='compare results against baseline json')
+    parser.add_argument('--tolerance', default=0.2, type=float, help='relative slowdown flagged as regression')
+
+# time per call; best of repeat after one warm-up call
+def timeit(func, repeat=3):
+    func()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# every melody note plus break; (n_wires + 1, n_wires)
+def get_inputs(n):
+    return np.vstack([np.eye(n, dtype=int), np.zeros(n, dtype=int)])
+
+# full-batch miss-fingering-like cost
+def get_cost(model, inputs):
+    import pennylane.numpy as pnp
+    def cost(weights):
+        model.set_weights(weights)
+        outputs = 0.5 * (model(inputs) + 1)
+        return pnp.log(outputs + 1e-8).mean()
+    return cost
+
+# defaults of an entry point's args, e.g., qoncert
+def get_defaults(module):
+    parser = argparse.ArgumentParser()
+    module.add_args(parser)
+    return parser.parse_args([])
+
+# time per qusician call over all notes; expectation and sampling
+def bench_call(args):
+    results = list()
+    for ansatz in args.ansatzes:
+        for depth in args.depths:
+            for n in args.num_wires:
+                wires = args.wires[:n]
+                model = qusic.Qusic(layers=[depth, len(wires)], wires=wires, ansatz=ansatz)
+                inputs = get_inputs(len(wires))
+                for mode in ['expval', 'sample']:
+                    sec = timeit(lambda: model(inputs, sample=mode == 'sample'), repeat=args.repeat)
+                    results.append({'ansatz': ansatz, 'layers': depth, 'wires': len(wires), 'mode': mode,
+                                    'sec_per_call': sec})
+                    print(f'{ansatz:>26s} {depth:4d} {len(wires):3d} {mode:>7s} {sec:10.4f} sec/call')
+    return results
+
+# time per qaestro optimizer step on full-batch cost; first ansatz and depth
+def bench_step(args):
+    import qaestro
+    ansatz, depth = args.ansatzes[0], args.depths[0]
+    results = list()
+    for opt in args.opts:
+        model = qusic.Qusic(layers=[depth, len(args.wires)], wires=args.wires, ansatz=ansatz)
+        cost = get_cost(model, get_inputs(len(args.wires)))
+        teacher = qaestro.get_opt(argparse.Namespace(opt=opt, lr=0.01))
+        state = [model.weights]
+
+        def step():
+            state[0], _ = teacher.step_and_cost(cost, state[0])
+        try:
+            sec = timeit(step, repeat=args.repeat)
+        except Exception as e: # optimizer not supported for plain cost functions, e.g., QNG
+            if args.verb: print('skip', opt, e)
+            sec = float('nan')
+        results.append({'opt': opt, 'ansatz': ansatz, 'layers': depth, 'sec_per_step': sec})
+        print(f'{opt:>26s} {sec:10.4f} sec/step')
+    return results
+
+# time per raw waveform synthesis per instrument
+def bench_generate(args):
+    import qoncert
+    import synth
+    syn = synth.get_syn()
+    duration = get_defaults(qoncert).duration
+    results = list()
+    for sound in args.sounds:
+        sec = timeit(lambda: syn.generate(sound, 'A', 4, duration), repeat=args.repeat)
+        results.append({'sound': sound, 'sec_per_note': sec})
+        print(f'{sound:>10s} {sec:10.4f} sec/note')
+    return results
+
+# time per harmony line synthesis per arpeggio style; cached waveforms, i.e., stroke scheduling and mixing
+def bench_synthesize(args):
+    import qoncert
+    import synth
+    config = get_defaults(qoncert)
+    config.verb = False
+    config.wires = args.wires
+    config.stroke = 3
+    cache = synth.Cache(rate=config.rate)
+    root = get_inputs(len(args.wires))[0]
+    notes = root + np.roll(root, 2) + np.roll(root, 4) # root triad
+    results = list()
+    for arpe in args.arpes:
+        config.arpe = arpe
+        sec = timeit(lambda: qoncert.synthesize(config, notes, octave=config.harmony, stroke=config.stroke,
+                                                cache=cache), repeat=args.repeat)
+        results.append({'arpe': arpe, 'stroke': config.stroke, 'sec_per_line': sec})
+        print(f'{arpe:>10s} {sec:10.4f} sec/line')
+    return results
+
+# end-to-end concert of twinkle score; fresh interpreter, batched play, render and wav writing, no playback
+def bench_concert(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        cmd = ['qoncert.py', '--no-play', '--wires'] + args.wires \
+            + ['--record', os.path.join(tmp, 'play.npy'), '--wav', os.path.join(tmp, 'play.wav')]
+        sec = run_python(cmd, repeat=args.repeat)
+    print(f"{'twinkle':>10s} {sec:10.4f} sec/concert")
+    return [{'score': 'twinkle', 'mode': 'render', 'wires': len(args.wires), 'sec_per_concert': sec}]
+
+# wall time of live twinkle concert (note-by-note pipeline) into null sink
+def bench_live(args):
+    cmd = ['qoncert.py', '--live', '--sink', 'null', '--wires'] + args.wires
+    sec = run_python(cmd, repeat=args.repeat)
+    print(f"{'twinkle':>10s} {sec:10.4f} sec/live")
+    return [{'score': 'twinkle', 'mode': 'live', 'wires': len(args.wires), 'sec_per_concert': sec}]
+
+# multi-octave keyboard of n semitones from C3
+def keyboard(n):
+    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    return [f'{notes[k % 12]}{3 + k // 12}' for k in range(n)]
+
+# peak traced memory of one call in MB
+def peak(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+# time and memory per call vs. keyboard size and simulation; first depth, layers (depth, n_wires)
+def bench_scale(args):
+    depth = args.depths[0]
+    results = list()
+    for ansatz in args.ansatzes:
+        for sim in args.sims:
+            for n in args.scale_wires:
+                model = qusic.Qusic(layers=[depth, n], wires=keyboard(n), ansatz=ansatz, sim=sim)
+                model.set_weights(np.asarray(model.weights)) # inference, as loaded models
+                size = max(len(cone) for cone, _ in model.cones) if sim == 'lightcone' else n
+                inputs = get_inputs(n)
+                if sim != 'mps' and size > args.max_qubits:
+                    sec, mb = float('nan'), float('nan')
+                    if args.verb: print('skip', ansatz, sim, n, 'qubits', size)
+                else:
+                    sec = timeit(lambda: model(inputs), repeat=args.repeat)
+                    mb = peak(lambda: model(inputs))
+                results.append({'ansatz': ansatz, 'layers': depth, 'sim': sim, 'wires': n, 'qubits': size,
+                                'sec_per_call': sec, 'peak_mb': mb})
+                print(f'{ansatz:>26s} {sim:>12s} {n:3d} wires {size:3d} qubits {sec:10.4f} sec/call {mb:10.1f} MB')
+    return results
+
+# time per gradient of full-batch miss-fingering-like cost
+def bench_grad(args):
+    import pennylane as qml
+    results = list()
+    for ansatz in args.ansatzes:
+        for depth in args.depths:
+            for method in args.methods:
+                model = qusic.Qusic(layers=[depth, len(args.wires)], wires=args.wires,
+                                    ansatz=ansatz, diff_method=method)
+                grad = qml.grad(get_cost(model, get_inputs(len(args.wires))))
+
+                try:
+                    sec = timeit(lambda: grad(model.weights), repeat=args.repeat)
+                except Exception as e: # method not supported for this configuration
+                    if args.verb: print('skip', ansatz, depth, method, e)
+                    sec = float('nan')
+                results.append({'ansatz': ansatz, 'layers': depth, 'params': int(np.size(model.weights)),
+                                'diff_method': method, 'sec_per_grad': sec})
+                print(f'{ansatz:>26s} {depth:4d} {method:>16s} {sec:10.4f} sec/grad')
+    return results
+
+# wall time (and epochs) to reach target validation bce per optimizer; full-batch teaching, validated every epoch
+def bench_target(args):
+    import qaestro
+    import chord
+    results = list()
+    for ansatz in args.ansatzes:
+        for opt in args.target_opts:
+            teach = get_defaults(qaestro)
+            teach.ansatz, teach.opt, teach.lr, teach.epoch = ansatz, opt, args.target_lr, args.max_epochs
+            teach.batch_size, teach.val_every, teach.target_loss, teach.ckpt_every = 0, 1, args.target_loss, 0
+            teach.verb = False
+            qusic.seeding(args.seed)
+            model = qusic.get_model(teach)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                model, loss = qaestro.teach(teach, model)
+            sec = time.perf_counter() - start
+            melodies = model.encode(teach.wires + ['-'])
+            harmonies = model.encode(chord.get_chords(chords=teach.chords) + [['-']])
+            val = float(qaestro.bce(model(melodies, sample=False), harmonies))
+            reached = val <= args.target_loss
+            results.append({'ansatz': ansatz, 'layers': teach.layers[0], 'opt': opt, 'target': args.target_loss,
+                            'sec_to_target': sec if reached else float('nan')})
+            print(f'{ansatz:>26s} {opt:>20s} {len(loss):5d} epochs {sec:10.4f} sec bce {val:.4f}', '' if reached else 'not reached')
+    return results
+
+# time per teaching epoch on chromatic keyboards (major triad per root), single-note and full batch;
+# errors propagate, so this also checks that wide keyboards stay teachable
+def bench_teach(args):
+    import qaestro
+    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    results = list()
+    for ansatz in args.ansatzes:
+        for n in args.teach_wires:
+            for batch in [1, 0]:
+                teach = get_defaults(qaestro)
+                teach.ansatz, teach.layers, teach.wires = ansatz, [args.depths[0], n], notes[:n]
+                teach.chords = [f'{root}M' for root in notes[:n]]
+                teach.epoch, teach.batch_size, teach.val_every, teach.ckpt_every = args.teach_epochs, batch, args.teach_epochs, 0
+                teach.verb = False
+                qusic.seeding(args.seed)
+                model = qusic.get_model(teach)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    qaestro.teach(teach, model)
+                sec = (time.perf_counter() - start) / args.teach_epochs
+                results.append({'ansatz': ansatz, 'layers': args.depths[0], 'wires': n, 'batch': batch,
+                                'sec_per_epoch': sec})
+                print(f'{ansatz:>26s} {n:3d} wires batch {batch:2d} {sec:10.4f} sec/epoch')
+    return results
+
+# fastest method per configuration
+def report_grad(args, results):
+    print('# fastest')
+    for ansatz in args.ansatzes:
+        for depth in args.depths:
+            runs = [r for r in results if r['ansatz'] == ansatz and r['layers'] == depth and r['sec_per_grad'] == r['sec_per_grad']]
+            if len(runs) > 0:
+                best = min(runs, key=lambda r: r['sec_per_grad'])
+                print(f"{ansatz:>26s} {depth:4d} {best['diff_method']:>16s}")
+
+# wall time of a fresh interpreter
+def run_python(cmd, repeat=3):
+    root = os.path.dirname(os.path.abspath(__file__))
+    return timeit(lambda: subprocess.run([sys.executable] + cmd, cwd=root, check=True,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), repeat=repeat)
+
+# startup cost per entry point; bare interpreter, module import and --help
+def bench_startup(args):
+    results = list()
+    base = run_python(['-c', 'pass'], repeat=args.repeat)
+    print(f"{'python':>10s} {base:8.4f} sec")
+    for entry in args.entries:
+        imp = run_python(['-c', f'import {entry}'], repeat=args.repeat)
+        cli = run_python([f'{entry}.py', '--help'], repeat=args.repeat)
+        results.append({'entry': entry, 'import_sec': imp - base, 'help_sec': cli - base})
+        print(f'{entry:>10s} import {imp - base:8.4f} sec, --help {cli - base:8.4f} sec')
+    return results
+
+# environment of the run, stored along with results
+def get_meta(args):
+    import importlib.metadata
+    versions = dict()
+    for package in ['numpy', 'pennylane']:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system(),
+            'cpus': os.cpu_count(), 'seed': args.seed, 'repeat': args.repeat, 'versions': versions}
+
+# timing (and memory) fields are metrics; all other fields identify the measurement
+def split(record):
+    metric = lambda k: 'sec' in k or k.endswith('_mb')
+    key = tuple(sorted((k, v) for k, v in record.items() if not metric(k)))
+    return key, {k: v for k, v in record.items() if metric(k)}
+
+# ratio of current to baseline time per measurement; slowdown beyond tolerance is a regression
+def compare(results, baseline, tolerance=0.2):
+    regressions = list()
+    for bench, records in results.items():
+        base = dict(split(record) for record in baseline['results'].get(bench, []))
+        for record in records:
+            key, metrics = split(record)
+            if key not in base:
+                print(f'{bench:>10s} new', dict(key))
+                continue
+            for name, sec in metrics.items():
+                ref = base[key].get(name, float('nan'))
+                ratio = sec / ref if ref > 0 else float('nan')
+                flag = ''
+                if ratio > 1 + tolerance:
+                    flag = 'REGRESSION'
+                    regressions.append({'bench': bench, **dict(key), 'metric': name, 'baseline': ref, 'current': sec})
+                elif ratio < 1 - tolerance:
+                    flag = 'faster'
+                print(f"{bench:>10s} {' '.join(str(v) for _, v in key):>40s} {ref:10.4f} -> {sec:10.4f} {ratio:6.2f}x {flag}")
+    print('regressions:', len(regressions))
+    return regressions
+
+# main
+def main(args):
+    if args.verb: print('# args:', args)
+
+    # random seed
+    qusic.seeding(args.seed, verb=args.verb)
+
+    results = dict()
+    if 'call' in args.bench:
+        results['call'] = bench_call(args)
+    if 'step' in args.bench:
+        results['step'] = bench_step(args)
+    if 'generate' in args.bench:
+        results['generate'] = bench_generate(args)
+    if 'synthesize' in args.bench:
+        results['synthesize'] = bench_synthesize(args)
+    if 'concert' in args.bench:
+        results['concert'] = bench_concert(args)
+    if 'live' in args.bench:
+        results['live'] = bench_live(args)
+    if 'grad' in args.bench:
+        results['grad'] = bench_grad(args)
+        report_grad(args, results['grad'])
+    if 'startup' in args.bench:
+        results['startup'] = bench_startup(args)
+    if 'scale' in args.bench:
+        results['scale'] = bench_scale(args)
+    if 'target' in args.bench:
+        results['target'] = bench_target(args)
+    if 'teach' in args.bench:
+        results['teach'] = bench_teach(args)
+
+    # baseline
+    if args.baseline != None:
+        with open(args.baseline, 'w') as file:
+            json.dump({'meta': get_meta(args), 'results': results}, file, indent=1)
+        print('baseline:', args.baseline)
+    if args.compare != None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        results['regressions'] = compare(results, baseline, tolerance=args.tolerance)
+    return results
+
+if __name__ == '__main__':
+    args = get_args()
+
+    results = main(args)
+    if len(results.get('regressions', [])) > 0:
+        sys.exit(1)
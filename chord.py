@@ -1,39 +1,108 @@
 # Toshiaki Koike-Akino, 2022
 # Chord ansatz 
 
-import pennylane as qml
 import argparse
+import numpy as np
+
+# permutation gates (basis states to basis states); simulated as integer bit operations
+PERMUTATIONS = ['PauliX', 'CNOT', 'SWAP', 'Toffoli']
 
 def get_wires():
     wires = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
     return wires
 
 def get_device(wires, shots=1):
+    import pennylane as qml # deferred until circuits are built
     dev = qml.device('default.qubit', wires=wires, shots=shots)
     return dev
 
+# semitones and chord intervals; triads and 7th chords
+NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+INTERVALS = {
+    'M': [0, 4, 7], # major
+    'm': [0, 3, 7], # minor
+    'dm': [0, 3, 6], # diminished
+    'aug': [0, 4, 8], # augmented
+    '7': [0, 4, 7, 10], # dominant 7th
+    'M7': [0, 4, 7, 11], # major 7th
+    'm7': [0, 3, 7, 10], # minor 7th
+    'm7b5': [0, 3, 6, 10], # half-diminished 7th
+}
+
+# harmony notes (root first) per chord name, e.g., 'CM': ['C', 'E', 'G'], 'G7': ['G', 'B', 'D', 'F']
+def get_harmony():
+    harmony = dict()
+    for k, root in enumerate(NOTES):
+        for kind, intervals in INTERVALS.items():
+            harmony[f'{root}{kind}'] = [NOTES[(k + i) % 12] for i in intervals]
+    return harmony
+
 def get_chords(chords=['CM', 'Dm', 'Em', 'FM', 'GM', 'Am', 'Bdm']):
-    # harmony triplet
-    harmony = {
-        'CM': ['C', 'E', 'G'], # CM
-        'Dm': ['D', 'F', 'A'], # Dm
-        'Em': ['E', 'G', 'B'], # Em
-        'FM': ['F', 'A', 'C'], # FM
-        'GM': ['G', 'B', 'D'], # GM
-        'Am': ['A', 'C', 'E'], # Am
-        'Bdm': ['B', 'D', 'F'], # Bdm
-    }
+    # harmony triplet (or quartet for 7th chords)
+    harmony = get_harmony()
     triplets = list()
     for chord in chords:
         triplets.append(harmony[chord])
     return triplets
 
+# chord ansatz gates; (name, wires), root controls other notes
+def chord_gates(chords):
+    gates = list()
+    for triplet in chords:
+        for note in triplet[1:]:
+            gates.append(('CNOT', [triplet[0], note]))
+    return gates
+
 # chord ansatz
 def chord_ansatz(chords):
-    for triplet in chords:
-        #print(triplet)
-        qml.CNOT(wires=[triplet[0], triplet[1]])        
-        qml.CNOT(wires=[triplet[0], triplet[2]])
+    import pennylane as qml
+    for name, wires in chord_gates(chords):
+        #print(name, wires)
+        getattr(qml, name)(wires=wires)
+
+# (name, wires) gates all basis-state permutations; fast path applies
+def permutation_only(gates):
+    return all(name in PERMUTATIONS for name, _ in gates)
+
+# gates of recorded pennylane circuit function (any callable); None unless permutation-only (fast path applies)
+def record(func, *args, **kwargs):
+    import pennylane as qml
+    with qml.queuing.AnnotatedQueue() as queue:
+        func(*args, **kwargs)
+    gates = list()
+    for op in queue.queue:
+        if op.name not in PERMUTATIONS:
+            return None
+        gates.append((op.name, list(op.wires)))
+    return gates
+
+# permutation of all 2^n basis states at once; wire 0 is most significant bit
+def permute(gates, wires, states=None):
+    n = len(wires)
+    bit = {wire: n - 1 - k for k, wire in enumerate(wires)} # bit position
+    states = np.arange(2 ** n) if states is None else np.array(states)
+    for name, targets in gates:
+        pos = [bit[wire] for wire in targets]
+        if name == 'PauliX':
+            states ^= 1 << pos[0]
+        elif name == 'CNOT':
+            states ^= ((states >> pos[0]) & 1) << pos[1]
+        elif name == 'Toffoli':
+            states ^= ((states >> pos[0]) & (states >> pos[1]) & 1) << pos[2]
+        elif name == 'SWAP':
+            flip = ((states >> pos[0]) ^ (states >> pos[1])) & 1
+            states ^= (flip << pos[0]) | (flip << pos[1])
+        else:
+            raise ValueError(f'not a permutation gate: {name}')
+    return states
+
+# basis (..., n) to state and back; wire 0 is most significant bit
+def basis2state(basis):
+    basis = np.asarray(basis)
+    return basis @ (1 << np.arange(basis.shape[-1] - 1, -1, -1))
+
+def state2basis(states, n):
+    return (np.asarray(states)[..., None] >> np.arange(n - 1, -1, -1)) & 1
 
 
 def get_melody(note):
@@ -57,6 +126,21 @@ def main(args, verb=False):
     wires = get_wires()
     if verb: print('wires', wires)
 
+    # permutation-only circuit detected from chord gates (no pennylane); all melody notes at once as bit operations
+    gates = chord_gates(chords) if args.sim != 'qnode' else None
+    if gates is not None and not permutation_only(gates):
+        gates = None
+    if args.sim == 'bits' and gates is None:
+        raise ValueError('chord ansatz is not permutation-only; use --sim qnode')
+    if verb: print('fast path', gates is not None)
+    if gates is not None:
+        melody = np.array([get_melody(note) for note in wires])
+        outputs = state2basis(permute(gates, wires, basis2state(melody)), len(wires))
+        for note, output in zip(wires, outputs):
+            print(note, np.tile(output, (args.shots, 1))) # deterministic shots
+        return
+
+    import pennylane as qml
     dev = get_device(wires, shots=args.shots)
     if verb: print('dev', dev)
     
@@ -88,6 +172,8 @@ def get_args():
     parser.add_argument('--chords', default=['CM', 'Dm', 'Em', 'FM', 'GM', 'Am', 'Bdm'], 
                         type=str, nargs='+', help='selected chord ansatz')
     parser.add_argument('--shots', default=1, type=int, help='number of shots')
+    parser.add_argument('--sim', default='auto', choices=['auto', 'bits', 'qnode'], type=str,
+                        help='bit-level permutation simulation if circuit is permutation-only (auto), forced, or statevector qnode')
     return parser.parse_args()
 
 if __name__ == '__main__':
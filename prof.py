@@ -0,0 +1,79 @@
+# (c) Toshiaki Koike-Akino, 2022
+# lightweight profiling; named timers and counters, dumped as json at exit
+# disabled by default: timer() hands back one shared no-op context and count() returns at once
+import threading
+import atexit
+import json
+import time
+
+enabled = False
+stats = dict() # name -> {'count', 'sec'}
+lock = threading.Lock() # live pipeline stages update from threads
+start = time.perf_counter()
+
+# profiling args to inherit
+def prof_args(parser):
+    parser.add_argument('--prof', default=None, type=str, help='dump per-stage timing json at exit')
+
+# no-op timer when disabled
+class NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+null = NullTimer()
+
+# wall-clock timer accumulated under name
+class Timer():
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add(self.name, time.perf_counter() - self.start)
+        return False
+
+# accumulate count and seconds
+def add(name, sec=0.0, n=1):
+    with lock:
+        stat = stats.setdefault(name, {'count': 0, 'sec': 0.0})
+        stat['count'] += n
+        stat['sec'] += sec
+
+# timer context; e.g., with prof.timer('qusic.qnode'): ...
+def timer(name):
+    return Timer(name) if enabled else null
+
+# counter; e.g., prof.count('qusic.circuits', len(inputs))
+def count(name, n=1):
+    if enabled:
+        add(name, n=n)
+
+# per-stage breakdown
+def report():
+    wall = time.perf_counter() - start
+    with lock:
+        stages = {name: dict(stat, mean=stat['sec'] / stat['count'] if stat['count'] > 0 else 0.0,
+                             share=stat['sec'] / wall if wall > 0 else 0.0)
+                  for name, stat in sorted(stats.items())}
+    return {'wall': wall, 'stages': stages}
+
+def dump(fname):
+    with open(fname, 'w') as file:
+        json.dump(report(), file, indent=1)
+
+# enable from args; dump json at exit
+def setup(args, verb=False):
+    global enabled, start
+    fname = getattr(args, 'prof', None)
+    if fname == None:
+        return
+    enabled = True
+    start = time.perf_counter()
+    atexit.register(dump, fname)
+    if verb: print('profiling to', fname)
@@ -7,6 +7,11 @@ import argparse
 import qusic
 import chord
 from tqdm import tqdm
+import pickle
+import prof
+import math
+import time
+import sys
 import os
 
 # args
@@ -16,6 +21,7 @@ def get_args():
     parser.add_argument('--verb', action='store_true', help='verbose')
     parser.add_argument('--seed', default=1, type=int, help='seed for main')
     parser.add_argument('--showfig', action='store_true', help='show figure')
+    prof.prof_args(parser)
 
     # add args
     add_args(parser)
@@ -35,8 +41,13 @@ def add_args(parser):
     parser.set_defaults(ansatz='RandomLayers')
     parser.set_defaults(layers=[2, 7])
     parser.set_defaults(wires=['C', 'D', 'E', 'F', 'G', 'A', 'B']) # single octave (w/o sharp)
-    parser.add_argument('--chords', default=['CM', 'Dm', 'Em', 'FM', 'GM', 'Am', 'Bdm'], type=str,
+    parser.add_argument('--chords', default=['CM', 'Dm', 'Em', 'FM', 'GM', 'Am', 'Bdm'], type=str, nargs='+',
                         help='chords to learn')
+    parser.add_argument('--name', default=None, type=str, help='run name (default: ansatz_layers)')
+    parser.add_argument('--models', default='models', type=str, help='model directory')
+    parser.add_argument('--plots', default='plots', type=str, help='plot directory')
+    parser.add_argument('--save', default='npz', choices=['npz', 'pkl'], type=str,
+                        help='save compact npz model (config + weights) or dill-pickled model')
     
 # quantum maestro teacher args (optimizer args)
 def qaestro_args(parser):
@@ -44,17 +55,128 @@ def qaestro_args(parser):
     parser.add_argument('--opt', default='AdamOptimizer', 
                         choices=['AdamOptimizer', 'AdagradOptimizer', 'GradientDescentOptimizer', 
                                  'MomentumOptimizer', 'NesterovMomentumOptimizer', 'RMSPropOptimizer', 'QNGOptimizer', 
-                                 #'ShotAdaptiveOptimizer', 'LieAlgebraOptimizer', 'RotosolveOptimizer', 'RotoselectOptimizer',
+                                 'RotosolveOptimizer', # batched closed form, no lr; best with --batch-size 0
+                                 #'ShotAdaptiveOptimizer', 'LieAlgebraOptimizer', 'RotoselectOptimizer',
                                  ],
                         help='optimizer. (some are not tested)')
     parser.add_argument('--lr', default=0.01, type=float, help='learning rate (stepsize)')
     parser.add_argument('--epoch', default=300, type=int, help='number of epochs')
+    parser.add_argument('--batch-size', default=1, type=int, help='melody notes per step (<=0 for full batch incl. break)')
+    parser.add_argument('--ckpt-every', default=0, type=int, help='checkpoint interval in epochs (0: off)')
+    parser.add_argument('--ckpt', default=None, type=str, help='checkpoint file (default: models/name.ckpt)')
+    parser.add_argument('--resume', action='store_true', help='resume teaching from checkpoint')
+    parser.add_argument('--val-every', default=10, type=int, help='validation interval in epochs over all notes (0: off)')
+    parser.add_argument('--patience', default=0, type=int,
+                        help='early stop after validations without improvement (0: off); best weights kept')
+    parser.add_argument('--min-delta', default=1e-4, type=float, help='validation loss improvement to reset patience')
+    parser.add_argument('--target-loss', default=0.0, type=float, help='stop once validation bce reaches this (0: off)')
+    parser.add_argument('--schedule', default='constant', choices=['constant', 'step', 'exp', 'cosine'], type=str,
+                        help='learning rate schedule')
+    parser.add_argument('--lr-decay', default=0.5, type=float, help='lr decay factor per --lr-step epochs (step/exp)')
+    parser.add_argument('--lr-step', default=100, type=int, help='epochs per lr decay (step/exp)')
+    parser.add_argument('--lr-min', default=0.0, type=float, help='final lr (cosine)')
+    parser.add_argument('--log-every', default=1, type=int, help='log line interval in epochs')
+    parser.add_argument('--log-interval', default=1.0, type=float, help='seconds between log flushes')
 
 # optimizer selction
 def get_opt(args):
+    if args.opt == 'RotosolveOptimizer': # closed form on batched expvals rather than qml.RotosolveOptimizer
+        return Rotosolve()
     opt = getattr(qml, args.opt)(stepsize=args.lr)
     return opt
 
+# learning rate at epoch
+def get_lr(args, epoch):
+    if args.schedule == 'step':
+        return args.lr * args.lr_decay ** (epoch // args.lr_step)
+    if args.schedule == 'exp':
+        return args.lr * args.lr_decay ** (epoch / args.lr_step)
+    if args.schedule == 'cosine':
+        return args.lr_min + 0.5 * (args.lr - args.lr_min) * (1 + math.cos(math.pi * epoch / args.epoch))
+    return args.lr
+
+# binary cross entropy of expval outputs (1,-1) against basis targets (0,1)
+def bce(outputs, targets, axis=None):
+    outputs = 0.5 * (outputs + 1) # (1,-1) to (0,1) prob domain
+    eps = 1e-8
+    loss = -targets * np.log(1.0 - outputs + eps) - (1 - targets) * np.log(outputs + eps)
+    return loss.mean(axis=axis)
+
+# gradient-free rotosolve; every weight is a rotation angle, so each wire expval is a + b cos(t) + c sin(t) in its shift t
+# 3 shifted weight sets per coordinate in one broadcasted call give a, b, c exactly;
+# bce of the reconstructed expvals (not itself a sinusoid) is then minimized over a grid of shifts, no circuit calls
+class Rotosolve():
+    def __init__(self, grid=360):
+        self.grid = grid # shifts per coordinate; includes 0, so a sweep never increases the loss
+        self.stepsize = None # no learning rate; schedules set it, unused
+
+    def __repr__(self):
+        return f'Rotosolve(grid={self.grid})'
+
+    # one sweep over all coordinates; (weights, cost before the sweep) as qml optimizers
+    # evaluate(weight_sets, inputs) -> expvals (sets, notes, wires), e.g., Qusic.evaluate
+    def step_and_cost(self, evaluate, weights, inputs, targets):
+        weights = np.array(weights, requires_grad=False)
+        flat = weights.reshape(-1) # view
+        shifts = np.array([0, 2 * np.pi / 3, -2 * np.pi / 3])
+        angles = np.linspace(-np.pi, np.pi, self.grid, endpoint=False)[:, None, None]
+        cost = None
+        for d in range(flat.size):
+            sets = np.tile(flat, (3, 1))
+            sets[:, d] += shifts
+            f0, f1, f2 = np.asarray(evaluate(sets.reshape((3,) + weights.shape), inputs))
+            a = (f0 + f1 + f2) / 3
+            b, c = f0 - a, (f1 - f2) / np.sqrt(3)
+            curves = np.clip(a + b * np.cos(angles) + c * np.sin(angles), -1, 1) # (grid, notes, wires)
+            losses = bce(curves, targets, axis=(1, 2))
+            if cost is None:
+                cost = float(bce(f0, targets))
+            flat[d] = (flat[d] + angles[np.argmin(losses), 0, 0] + np.pi) % (2 * np.pi) - np.pi
+        return np.array(weights, requires_grad=True), cost
+
+# buffered log lines; written at most once per interval
+class Log():
+    def __init__(self, interval=1.0, file=None):
+        self.interval = interval
+        self.file = file # None: sys.stdout at flush (follows redirection)
+        self.lines = list()
+        self.last = time.perf_counter()
+
+    def __call__(self, *items):
+        self.lines.append(' '.join(map(str, items)))
+        if time.perf_counter() - self.last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if len(self.lines) > 0:
+            file = sys.stdout if self.file is None else self.file
+            file.write('\n'.join(self.lines) + '\n')
+            file.flush()
+            self.lines.clear()
+        self.last = time.perf_counter()
+
+# run name
+def get_name(args):
+    title = '_'.join(map(str, args.layers))
+    return f'{args.ansatz}_{title}' if args.name == None else args.name
+
+# checkpoint file
+def get_ckpt(args):
+    return args.ckpt if args.ckpt != None else os.path.join(args.models, f'{get_name(args)}.ckpt')
+
+# save checkpoint atomically (temp file then rename); plain arrays only
+def save_ckpt(fname, state):
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    with open(fname + '.tmp', 'wb') as file:
+        pickle.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(fname + '.tmp', fname)
+
+def load_ckpt(fname):
+    with open(fname, 'rb') as file:
+        return pickle.load(file)
+
 # maestro teaching for a qusician student model
 def teach(args, student):
     # teacher
@@ -71,50 +193,113 @@ def teach(args, student):
     wires.append('-') # break
     print(args.wires)
     
+    # melody notes and harmony chords to basis; row per wire (+break)
+    melodies = student.encode(wires)
+    harmonies = student.encode(chords)
+    
     # cost to reduce miss-fingering
     def miss_finger(weights, **kwargs):
-        # melody-line note given
+        # melody-line notes given
         #note = np.random.choice(len(wires), size=2)[-1] # random choice of melody note (size=None, 1 not working?)
-        melody = wires[note] # melody line note
-        if args.verb: print('melody', note, melody)
+        if args.verb: print('melody', note, [wires[k] for k in note])
         
         # harmony to learn
-        harmony = chords[note] # chord notes
-        if args.verb: print('harmony', harmony)        
+        if args.verb: print('harmony', [chords[k] for k in note])
         
         # teach playing
-        inputs = student.notes2basis(melody) # notes to basis
-        targets = student.notes2basis(harmony) # notes to basis        
+        inputs = melodies[note] # (batch, wires)
+        targets = harmonies[note] # (batch, wires)
         
         # skill set
         student.set_weights(weights)
 
-        # student plays
+        # student plays whole batch in one broadcasted call
         outputs = student(inputs, sample=False) 
         if args.verb: print('inputs/targets/outputs', inputs, targets, outputs)
         
         # binary cross entropy loss
-        outputs = 0.5 * (outputs + 1) # (1,-1) to (0,1) prob domain
-        eps = 1e-8
-        loss = -targets * np.log(1.0 - outputs + eps) - (1 - targets) * np.log(outputs + eps)
-        loss = loss.mean()
-        
-        return loss
+        return bce(outputs, targets)
+
+    # exact validation over all melody notes (+break) in one batched call; (bce, chord hit rate)
+    def validate(weights):
+        student.set_weights(weights.numpy()) # plain array; one broadcasted pass at any width
+        outputs = student(melodies, sample=False)
+        played = outputs < 0 # most likely basis per wire; expval -1 for 1
+        return float(bce(outputs, harmonies)), float(np.mean(np.all(played == harmonies, axis=1)))
     
     # train loop
-    weights = student.weights
+    weights = np.array(student.weights, requires_grad=True) # trainable (loaded models hold plain arrays)
     loss_all = list()
-    train = np.random.choice(len(wires), size=args.epoch) # random choice of melody note to train
+    batch = len(wires) if args.batch_size <= 0 else min(args.batch_size, len(wires))
+    def schedule(epochs):
+        if batch == 1:
+            return np.random.choice(len(wires), size=(epochs, 1)) # random choice of melody note to train
+        # mini-batch of distinct notes (full batch covers all)
+        return np.stack([np.random.permutation(len(wires))[:batch] for _ in range(epochs)])
+    train = schedule(args.epoch)
 
-    for epoch in tqdm(range(args.epoch), leave=True, desc='teaching'):
+    # validation history (epoch, bce, hit rate), best weights and validations since improvement
+    val_all, best, wait = list(), None, 0
+
+    # resume; weights, optimizer accumulators, rng, epoch, loss history, note schedule and validation state
+    start = 0
+    ckpt = get_ckpt(args)
+    if args.resume and os.path.exists(ckpt):
+        state = load_ckpt(ckpt)
+        weights = np.array(state['weights'], requires_grad=True)
+        teacher.__dict__.update(state['teacher'])
+        np.random.set_state(state['rng'])
+        start = state['epoch']
+        loss_all = state['loss']
+        train = state['train']
+        val_all, best, wait = state.get('val', val_all), state.get('best', best), state.get('wait', wait)
+        if len(train) < args.epoch: # resumed with more epochs
+            train = np.concatenate([train, schedule(args.epoch - len(train))])
+        print('resuming:', ckpt, 'epoch', start)
+
+    log = Log(interval=args.log_interval)
+    for epoch in tqdm(range(start, args.epoch), initial=start, total=args.epoch, leave=True, desc='teaching'):
         note = train[epoch]
-        weights, loss = teacher.step_and_cost(miss_finger, weights, note=note)
+        teacher.stepsize = get_lr(args, epoch) # schedule
+        with prof.timer('qaestro.step'): # one gradient evaluation (or rotosolve sweep)
+            if isinstance(teacher, Rotosolve):
+                weights, loss = teacher.step_and_cost(student.evaluate, weights, melodies[note], harmonies[note])
+            else:
+                weights, loss = teacher.step_and_cost(miss_finger, weights, note=note)
         #student.set_weights(weights)
 
-        print(epoch, loss) #, weights, student.weights)
+        if epoch % args.log_every == 0:
+            log(epoch, loss) #, weights, student.weights)
         loss_all.append(loss)
+
+        # validation and early stopping on plateau
+        stop = False
+        if args.val_every > 0 and ((epoch + 1) % args.val_every == 0 or epoch + 1 == args.epoch):
+            with prof.timer('qaestro.validate'):
+                val, hit = validate(weights)
+            val_all.append((epoch + 1, val, hit))
+            log('validation:', epoch + 1, 'bce', val, 'hit', hit, 'lr', teacher.stepsize)
+            if best is None or val < best['loss'] - args.min_delta:
+                best, wait = {'epoch': epoch + 1, 'loss': val, 'hit': hit, 'weights': weights.numpy()}, 0
+            else:
+                wait += 1
+            stop = args.patience > 0 and wait >= args.patience
+            stop = stop or val <= args.target_loss
+
+        # checkpoint
+        if args.ckpt_every > 0 and ((epoch + 1) % args.ckpt_every == 0 or stop):
+            with prof.timer('qaestro.ckpt'):
+                save_ckpt(ckpt, {'weights': weights.numpy(), 'teacher': teacher.__dict__, 'rng': np.random.get_state(),
+                                 'epoch': epoch + 1, 'loss': loss_all, 'train': train,
+                                 'val': val_all, 'best': best, 'wait': wait})
+        if stop:
+            log('early stop:', epoch + 1, 'best epoch', best['epoch'], 'bce', best['loss'], 'hit', best['hit'])
+            break
+    log.flush()
     
-    # update weights
+    # update weights; best validated when early stopping
+    if args.patience > 0 and best is not None:
+        weights = np.array(best['weights'], requires_grad=True)
     student.set_weights(weights)
     #student.save()
     
@@ -123,6 +308,7 @@ def teach(args, student):
 # plot
 def plot(loss, title='plot', path='plots', showfig=False):
     import matplotlib.pyplot as plt
+    plt.figure() # fresh figure per run
     plt.plot(loss)
     plt.grid()
     plt.xlabel('Teaching Epoch')
@@ -136,13 +322,17 @@ def plot(loss, title='plot', path='plots', showfig=False):
         fname = os.path.join(path, fname)        
     plt.savefig(fname)
     if showfig: plt.show()
+    plt.close()
 
-def save(model, fname):
+def save(model, name, args):
+    if args.save == 'npz': # compact config + weights, no pickling
+        model.save(fname=f'{name}.npz', path=args.models)
+        return model
     #model.save(fname=fname, path='models') # not working :(
-    model.save_weights()
+    model.save_weights(fname=f'{name}.npy', path=args.models) # per-run file, safe for parallel runs
     model = qusic.get_model(args, verb=args.verb) # re-instantiate, avoiding pickling error
-    model.load_weights()
-    model.save(fname=fname, path='models')
+    model.load_weights(fname=f'{name}.npy', path=args.models)
+    model.save(fname=f'{name}.pkl', path=args.models)
     model.draw()
 
     return model # new instance with copied weights
@@ -153,6 +343,7 @@ def main(args):
 
     # random seed
     qusic.seeding(args.seed, verb=args.verb)
+    prof.setup(args, verb=args.verb)
         
     # qusic player
     model = qusic.get_model(args, verb=args.verb)
@@ -164,20 +355,18 @@ def main(args):
     model.draw()
     
     # save
-    title = '_'.join(map(str, args.layers))
-    fname = f'{args.ansatz}_{title}.pkl'
-    model = save(model, fname)
+    name = get_name(args)
+    model = save(model, name, args)
     
     # plot loss   
-    fname = f'{args.ansatz}_{title}'
-    plot(loss, title=fname, path='plots', showfig=args.showfig)
+    plot(loss, title=name, path=args.plots, showfig=args.showfig)
     
-    return model
+    return model, loss
 
 # main
 if __name__ == '__main__':
     args = get_args()
     
-    model = main(args)
+    model, loss = main(args)
 
     
\ No newline at end of file
@@ -1,11 +1,20 @@
 # (c) Toshiaki Koike-Akino, 2022
 # quantum concert
-import pennylane as qml
-import pennylane.numpy as np
+# heavy dependencies (pennylane, pygame, synthesizer) are imported lazily where needed
+import numpy as np
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from threading import Thread
+import queue
+import copy
+import json
+import time
+import os
 import qusic
 import twinkle
-import Synthesizer_in_Python.synthesizer as syn
+import synth
+import score
+import prof
 
 # args
 def get_args():
@@ -13,6 +22,7 @@ def get_args():
     # general
     parser.add_argument('--verb', action='store_true', help='verbose')
     parser.add_argument('--seed', default=1, type=int, help='seed for main')
+    prof.prof_args(parser)
     
     # add args
     add_args(parser)
@@ -34,9 +44,21 @@ def qoncert_args(parser):
     parser.add_argument('--rate', default=44.1e3, type=float, help='sampling rate (Hz)')
     parser.add_argument('--duration', default=0.5, type=float, help='whole-note sound duration (sec)')
     parser.add_argument('--wav', default='play.wav', type=str, help='recording wave file')
+    parser.add_argument('--stream', action='store_true', help='stream note blocks into wave file (bounded memory)')
+    # live
+    parser.add_argument('--no-play', action='store_true', help='save wave file without playing it back')
+    parser.add_argument('--live', action='store_true', help='live pipeline: play while qusician performs')
+    parser.add_argument('--sink', default='pygame', choices=['pygame', 'null'], type=str, help='live audio sink')
+    parser.add_argument('--queue', default=4, type=int, help='live pipeline queue size (blocks)')
     parser.add_argument('--qaestro', action='store_true', help='qaestro mode: no mis-fingering')
     parser.add_argument('--arpe', default='up', type=str,
                         choices=['rand', 'down', 'up', 'cap', 'cup'], help='arpeggio style')
+    # ensemble
+    parser.add_argument('--tracks', default=None, type=str,
+                        help='json file with a list of tracks, e.g., tracks.json holding '
+                             '[{"load": "models/a.npz", "sound": "organ", "volume": 0.5}]')
+    parser.add_argument('--stems', default=None, type=str, help='directory to save per-track wave files')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int, help='parallel track renderers')
 
 # add args
 def add_args(parser):
@@ -46,27 +68,25 @@ def add_args(parser):
     # qoncert args
     qoncert_args(parser)
 
+    # waveform cache args
+    synth.cache_args(parser)
+
+    # score file args
+    score.score_args(parser)
+
     # defaults
     #parser.set_defaults(wires=['C', 'D', 'E', 'F', 'G', 'A', 'B']) # single octave (w/o sharp)
 
-# melody
+# melody; whole score in one encoding pass
 def get_melody(model, score):
-    melody = list()
-    for note in score:
-        basis = model.notes2basis(note)
-        melody.append(basis)
-    return np.stack(melody)
-
-# play
-def play(model, melody):
-    if args.verb: print('qaestro mode')
-    played = list()
-    for note in melody:
-        typing = model(note, sample=True)
-        if args.qaestro: # no mis-fingering
-            typing = note + np.roll(note, 2) + np.roll(note, 4) # target
-        played.append(typing)
-    return np.stack(played)
+    return model.encode(score)
+
+# play; whole melody in one broadcasted pass
+def play(model, melody, qaestro=False):
+    played = model(melody, sample=True)
+    if qaestro: # no mis-fingering
+        played = melody + np.roll(melody, 2, axis=1) + np.roll(melody, 4, axis=1) # target
+    return played
     
 # record
 def record(music, fname='play.npy', path=None):
@@ -77,67 +97,266 @@ def record(music, fname='play.npy', path=None):
     np.save(fname, music)
     #melody, played = np.load('play.npy')
 
-def synthesize(args, notes, octave=4, stroke=1):
-    signals = list()
+# arpeggio; key order of j-th stroke
+def arpeggio(args, n, j=0):
+    if args.arpe == 'up':
+        order = np.arange(n)
+    elif args.arpe == 'down':
+        order = np.arange(n)[::-1]
+    elif args.arpe == 'rand':
+        order = np.random.permutation(n)
+    elif args.arpe == 'cap': # up-down
+        order = np.arange(n) if j % 2 == 0 else np.arange(n)[::-1]
+    elif args.arpe == 'cup': # down-up
+        order = np.arange(n)[::-1] if j % 2 == 0 else np.arange(n)
+    return order
+
+# strokes; (key, delay shift) of typed keys in playing order
+def strokes(args, notes, stroke=1):
+    played = list()
     for j in range(stroke):
-        # arpeggio
-        if args.arpe == 'up':
-            order = np.arange(len(notes))
-        elif args.arpe == 'down':
-            order = np.arange(len(notes))[::-1]
-        elif args.arpe == 'rand':
-            order = np.random.permutation(len(notes))
-        elif args.arpe == 'cap': # up-down
-            order = np.arange(len(notes)) if j % 2 == 0 else np.arange(len(notes))[::-1]
-        elif args.arpe == 'cup': # down-up
-            order = np.arange(len(notes))[::-1] if j % 2 == 0 else np.arange(len(notes))
+        order = arpeggio(args, len(notes), j)
         if args.verb: print('stroke', j, order)
-            
-        for k in range(len(notes)):
-            key = order[k]
+        for key in order:
             if notes[key] == 1:
-                note = args.wires[key]
-                signal = syn.generate(args.sound, note, octave, args.duration)
-                # stroke dealy
-                shift = (len(signals) + 1) * args.delay
-                if args.verb: print('shift', j, k, key, shift)
-                signal = np.roll(signal, shift)
-                #print('signal', signal.shape)
-                signals.append(signal)
-                
-    if len(signals) == 0: # break
-        signal = syn.generate(args.sound, 'C', octave, args.duration)
-        signals.append(signal * 0.0)        
-        
-    signals = np.vstack(signals)
-    #print('signals', signals.shape)
-    #signals = np.sum(signals, axis=0)
-    signals = np.mean(signals, axis=0)
-    #print('sum', signals.shape)
-    return signals
+                shift = (len(played) + 1) * args.delay # stroke delay
+                played.append((key, shift))
+    return played
 
+# longest delay tail spilling over the next notes
+def get_tail(args):
+    return args.delay * args.stroke * len(args.wires)
 
-# encore; play again to synthesize wave
-def encore(args, music, fname='play.wav'):
+# mix one note line in place into out at offset; true delay without wraparound
+def mix(args, out, offset, notes, octave=4, gain=1.0, stroke=1, cache=None, scratch=None):
+    generate = synth.get_generate(cache)
+    played = strokes(args, notes, stroke=stroke)
+    if len(played) == 0: # break
+        return out
+    gain = gain / len(played) # mean over typed keys
+    for key, shift in played:
+        signal = generate(args.sound, args.wires[key], octave, args.duration)
+        start = offset + shift
+        end = min(start + len(signal), len(out))
+        if scratch is None or end - start > len(scratch):
+            out[start:end] += gain * signal[:end - start]
+        else: # scaled into preallocated scratch, no temporaries
+            np.multiply(signal[:end - start], gain, out=scratch[:end - start])
+            out[start:end] += scratch[:end - start]
+        if args.verb: print('shift', key, shift)
+    return out
+
+# synthesize one note line; note length plus delay tail
+def synthesize(args, notes, octave=4, stroke=1, cache=None):
+    generate = synth.get_generate(cache)
+    size = len(generate(args.sound, 'C', octave, args.duration))
+    signals = np.zeros(size + get_tail(args))
+    return mix(args, signals, 0, notes, octave=octave, stroke=stroke, cache=cache)
+
+# render music into one preallocated buffer
+def render(args, music, cache=None):
     melody, harmony = music
-    wave = list()
+    generate = synth.get_generate(cache)
+    size = len(generate(args.sound, 'C', args.melody, args.duration)) # note length
+    wave = np.zeros(len(melody) * size + get_tail(args))
+    scratch = np.zeros(size)
     # synthesize one by one
-    for left, right in zip(melody, harmony): # left-hand melody, right-hand harmony
+    for n, (left, right) in enumerate(zip(melody, harmony)): # left-hand melody, right-hand harmony
+        if args.verb: print('left/right', left, right)
+        offset = n * size
+        with prof.timer('qoncert.mix'):
+            mix(args, wave, offset, left, octave=args.melody, gain=1.0 / (1.0 + args.volume),
+                cache=cache, scratch=scratch) # melody play
+            mix(args, wave, offset, right, octave=args.harmony, gain=args.volume / (1.0 + args.volume),
+                stroke=args.stroke, cache=cache, scratch=scratch) # harmony play
+    return wave
+
+# blocks of note pairs; yields finished blocks, carrying delay tails over a window of note plus tail
+def blocks(args, pairs, cache=None):
+    generate = synth.get_generate(cache)
+    size = len(generate(args.sound, 'C', args.melody, args.duration)) # note length
+    tail = get_tail(args)
+    window = np.zeros(size + tail)
+    scratch = np.zeros(size)
+    for left, right in pairs: # left-hand melody, right-hand harmony
         if args.verb: print('left/right', left, right)
-        L = synthesize(args, left, octave=args.melody) # melody play
-        R = synthesize(args, right, octave=args.harmony, stroke=args.stroke) # harmony play
-        signal = (L + R * args.volume) / (1.0 + args.volume)
-        wave.append(signal)
-    wave = np.hstack(wave)
+        with prof.timer('qoncert.mix'):
+            mix(args, window, 0, left, octave=args.melody, gain=1.0 / (1.0 + args.volume),
+                cache=cache, scratch=scratch) # melody play
+            mix(args, window, 0, right, octave=args.harmony, gain=args.volume / (1.0 + args.volume),
+                stroke=args.stroke, cache=cache, scratch=scratch) # harmony play
+        yield window[:size].copy()
+        # slide window by one note
+        window[:tail] = window[size:size + tail].copy()
+        window[tail:] = 0.0
+    if tail > 0:
+        yield window[:tail].copy()
+
+# stream music note by note
+def stream(args, music, cache=None):
+    melody, harmony = music
+    return blocks(args, zip(melody, harmony), cache=cache)
+
+# pipeline stage; put items into bounded queue, then end mark (also on failure)
+def produce(items, out, errors):
+    try:
+        for item in items:
+            out.put(item)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        out.put(None)
+
+# pipeline stage; get items from queue until end mark
+def consume(inp):
+    while True:
+        item = inp.get()
+        if item is None:
+            return
+        yield item
+
+# qusician performs chunk by chunk; each melody chunk (n, n_wires) in one broadcasted pass
+def rehearse(model, chunks, qaestro=False):
+    for melody in chunks:
+        with prof.timer('qoncert.play'):
+            harmony = play(model, melody, qaestro=qaestro)
+        yield from zip(melody, harmony)
+
+# qusician performs note by note
+def perform(model, melody, qaestro=False):
+    for note in melody:
+        typing = model(note[None], sample=True)[0]
+        if qaestro: # no mis-fingering
+            typing = note + np.roll(note, 2) + np.roll(note, 4) # target
+        yield note, typing
+
+# live; qusician -> synthesis/mixing -> audio sink, with bounded queues in between
+def live(args, model, melody, cache=None):
+    notes = queue.Queue(maxsize=args.queue)
+    audio = queue.Queue(maxsize=args.queue)
+    errors = list()
+    stages = [Thread(target=produce, args=(perform(model, melody, qaestro=args.qaestro), notes, errors), daemon=True),
+              Thread(target=produce, args=(blocks(args, consume(notes), cache=cache), audio, errors), daemon=True)]
+
+    sink = twinkle.get_sink(args.sink, rate=args.rate)
+    start = time.perf_counter()
+    for stage in stages:
+        stage.start()
+    latency = None
+    for block in consume(audio):
+        sink.play(block)
+        if latency is None: # time to first sound
+            latency = time.perf_counter() - start
+            print(f'first audio latency: {latency:.4f} sec (note duration {args.duration} sec)')
+    sink.close()
+    if len(errors) > 0: # upstream stages may block on full queues; daemon threads left behind
+        raise errors[0]
+    for stage in stages:
+        stage.join()
+    if args.verb: print('live total:', time.perf_counter() - start)
+    return latency
+
+# play wave file back; skipped with --no-play
+def listen(args, fname, notes):
+    if args.no_play:
+        return
+    if args.verb: print('listen to ', fname)
+    twinkle.init(2)
+    twinkle.play_notes(fname, notes * args.duration)
+
+# encore; play again to synthesize wave
+def encore(args, music, fname='play.wav', cache=None):
+    melody, harmony = music
+    if args.stream: # chunked wav writing
+        if args.verb: print('streaming', fname)
+        with synth.WavWriter(fname, args.rate) as writer:
+            for block in stream(args, music, cache=cache):
+                writer.write(block)
+    else:
+        wave = render(args, music, cache=cache)
     
-    # save wav
-    if args.verb: print('saving', fname, wave.shape)
-    syn.writeArrayToWavFilename(wave, args.rate, fname)
+        # save wav
+        if args.verb: print('saving', fname, wave.shape)
+        with prof.timer('wav.write'):
+            synth.get_syn().writeArrayToWavFilename(wave, args.rate, fname)
     
     # play wav
-    if args.verb: print('listen to ', fname)
-    twinkle.init(2)
-    twinkle.play_notes(fname, len(melody) * args.duration)
+    listen(args, fname, len(melody))
+
+# per-track args; track keys override args (track-only keys: name, part, octave, volume)
+def track_args(args, track):
+    config = copy.copy(args)
+    config.part = 'harmony' # melody line as written or harmony line played by track qusician
+    config.octave = args.harmony if track.get('part') != 'melody' else args.melody
+    config.volume = 1.0
+    for key, value in track.items():
+        key = key.replace('-', '_')
+        if key not in vars(config) and key != 'name':
+            raise ValueError(f'unknown track key: {key}')
+        setattr(config, key, value)
+    return config
+
+# render one track in worker; own qusician model, instrument, octave, arpeggio and stroke
+def render_track(args, track, steps):
+    args = track_args(args, track)
+    qusic.seeding(args.seed)
+    model = qusic.get_model(args)
+    args.wires = model.wires.copy()
+    notes = model.encode(steps)
+    if args.part != 'melody':
+        notes = play(model, notes, qaestro=args.qaestro)
+    cache = synth.get_cache(args)
+    size = len(synth.get_generate(cache)(args.sound, 'C', args.octave, args.duration)) # note length
+    wave = np.zeros(len(notes) * size + get_tail(args))
+    scratch = np.zeros(size)
+    for n, line in enumerate(notes):
+        mix(args, wave, n * size, line, octave=args.octave, stroke=args.stroke, cache=cache, scratch=scratch)
+    return wave
+
+# ensemble of tracks rendered in process pool, summed by volume; optional per-track stems
+def ensemble(args, steps, fname='play.wav'):
+    with open(args.tracks) as file:
+        tracks = json.load(file)
+    if not isinstance(tracks, list) or len(tracks) == 0:
+        raise ValueError(f'no tracks in {args.tracks}: expected a non-empty json list')
+    tracks = [dict({'name': f'track{k}', 'seed': args.seed + k}, **track) for k, track in enumerate(tracks)]
+    if args.verb: print('tracks:', tracks)
+    volumes = [track_args(args, track).volume for track in tracks] # also rejects unknown keys before rendering
+    if sum(volumes) == 0:
+        raise ValueError(f'track volumes sum to zero in {args.tracks}: {volumes}')
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(tracks))) as pool:
+        waves = list(pool.map(render_track, [args] * len(tracks), tracks, [steps] * len(tracks)))
+
+    wave = np.zeros(max(len(w) for w in waves))
+    for w, volume in zip(waves, volumes):
+        wave[:len(w)] += volume * w
+    wave /= sum(volumes)
+
+    # save wav
+    if args.stems != None:
+        os.makedirs(args.stems, exist_ok=True)
+        for track, w in zip(tracks, waves):
+            synth.write_wav(os.path.join(args.stems, f"{track['name']}.wav"), w, args.rate)
+    with prof.timer('wav.write'):
+        synth.write_wav(fname, wave, args.rate)
+
+    # play wav
+    listen(args, fname, len(steps))
+    return wave
+
+# concert of score file; streamed from reader through batched play and synthesis into wave file (bounded memory)
+def recital(args, model, steps, fname='play.wav', cache=None):
+    chunks = (model.encode(chunk) for chunk in score.chunks(steps, args.chunk))
+    notes = 0
+    if args.verb: print('streaming', fname)
+    with synth.WavWriter(fname, args.rate) as writer:
+        for block in blocks(args, rehearse(model, chunks, qaestro=args.qaestro), cache=cache):
+            writer.write(block)
+            notes += 1
+
+    # play wav
+    listen(args, fname, notes)
+    return notes
 
     
     
@@ -147,32 +366,62 @@ def main(args):
 
     # random seed
     qusic.seeding(args.seed, verb=args.verb)
+    prof.setup(args, verb=args.verb)
     
     # qusic player
     model = qusic.get_model(args, verb=args.verb)
-    model.draw()
+    if args.verb: model.draw() # builds qnode (pennylane)
     #model.save()
     #model(np.random.randint(2, size=7))
     args.wires = model.wires.copy()
 
+    # waveforms synthesized once per (sound, note, octave)
+    cache = synth.get_cache(args, verb=args.verb)
+
+    # ensemble of tracks; score (file or twinkle) shared by all tracks
+    if args.tracks != None:
+        steps = twinkle.get_score(octave=0) if args.score == None else \
+            list(score.read(args.score, octave=any(wire[-1].isdigit() for wire in model.wires), grid=args.grid))
+        ensemble(args, steps, fname=args.wav)
+        return
+
+    # score file; read lazily, never materialized (no recording)
+    if args.score != None:
+        octave = any(wire[-1].isdigit() for wire in model.wires) # match wire names
+        steps = score.read(args.score, octave=octave, grid=args.grid)
+        if args.live:
+            chunks = (model.encode(chunk) for chunk in score.chunks(steps, args.chunk))
+            live(args, model, (note for melody in chunks for note in melody), cache=cache)
+        else:
+            recital(args, model, steps, fname=args.wav, cache=cache)
+        return
+
     # score
-    score = twinkle.get_score(octave=0) # no octave info
-    if args.verb: print('score:', score)
+    notes = twinkle.get_score(octave=0) # no octave info
+    if args.verb: print('score:', notes)
     
     # melody lines
-    melody = get_melody(model, score)
+    melody = get_melody(model, notes)
     if args.verb: print('melody:', melody)
 
+    # live concert; listen while playing
+    if args.live:
+        live(args, model, melody, cache=cache)
+        return
+
     # play harmony lines
-    harmony = play(model, melody)
+    with prof.timer('qoncert.play'):
+        harmony = play(model, melody, qaestro=args.qaestro)
     if args.verb: print('harmony:', harmony)
 
     # record his playing
     music = (melody, harmony)
-    record(music, fname=args.record)
+    with prof.timer('qoncert.record'):
+        record(music, fname=args.record)
     
     # encore
-    encore(args, music, fname=args.wav)
+    encore(args, music, fname=args.wav, cache=cache)
+    if args.verb: print('cache hits/misses:', cache.hits, cache.misses)
     
     
 
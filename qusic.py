@@ -1,11 +1,20 @@
 # (c) Toshiaki Koike-Akino, 2022
 # VQC music player
-import pennylane as qml
-import pennylane.numpy as np
+# pennylane (and dill) are imported lazily, only when qnodes are built (or pickles are used)
+import numpy as np
 import argparse
-import dill as pickle
-#import pickle
+import functools
+import hashlib
+import json
 import os
+import prof
+
+# compact model format version
+FORMAT_VERSION = 1
+
+# broadcasted (RX bit-flip) embedding fails under autograd from this many wires on default.qubit
+# (shape-mismatch for sum, even with requires_grad=False); autograd weights loop rows through basis embedding instead
+BROADCAST_WIRES = 12
 
 # args
 def get_args():
@@ -13,6 +22,7 @@ def get_args():
     # general
     parser.add_argument('--verb', action='store_true', help='verbose')
     parser.add_argument('--seed', default=1, type=int, help='seed for main')
+    prof.prof_args(parser)
     
     # qusic args
     qusic_args(parser)
@@ -32,70 +42,171 @@ def qusic_args(parser):
     parser.add_argument('--qseed', default=42, type=int, help='RandomLayers random seed')
     parser.add_argument('--shots', default=1, type=int, help='number of quantum shots')
     parser.add_argument('--load', default=None, type=str, help='loading model file')
+    parser.add_argument('--compiled', action='store_true', help='compiled inference via cached unitary lookup table')
+    parser.add_argument('--sampler', default='qnode', choices=['qnode', 'engine'], type=str,
+                        help='sampling by device shots or by bulk draws from per-input distributions')
+    parser.add_argument('--diff-method', default='best', type=str,
+                        choices=['best', 'backprop', 'adjoint', 'parameter-shift'],
+                        help='differentiation method for training qnode')
+    parser.add_argument('--sim', default='statevector', choices=['statevector', 'lightcone', 'mps'], type=str,
+                        help='simulation: full statevector, per-wire light cones, or matrix product state (default.tensor; needs quimb)')
+    parser.add_argument('--bond-dim', default=None, type=int, help='max bond dimension for mps simulation')
 
 # quantum musician (qusician) class
 class Qusic():
+    # compiled lookup table (defaults also cover models pickled before compiled mode)
+    compiled = False
+    table = None
+    table_key = None
+    diff_method = 'best'
+    sampler = 'qnode'
+    sim = 'statevector'
+    bond_dim = None
+    rng = None
+    dists = None
+    dev_name = None
+    ansatz_name = None
+
     def __init__(self, 
                  layers=[1,7], wires=['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4'],
                  dev='default.qubit', ansatz='BasicEntanglerLayers', shots=1, qseed=42,
-                 verb=False,
+                 compiled=False, diff_method='best', sampler='qnode', sim='statevector', bond_dim=None,
+                 seed=None, weights=None, verb=False,
                  ):
         self.layers = layers
         self.wires = wires
         self.shots = shots
         self.verb = verb
         self.qseed = qseed if ansatz == 'RandomLayers' else -1
+        self.compiled = compiled
+        self.diff_method = diff_method
+        self.sampler = sampler
+        self.sim = sim
+        self.bond_dim = bond_dim
+        self.set_seed(seed)
 
-        self.dev = qml.device(dev, wires=self.wires)
-        self.dev_shots = qml.device(dev, wires=self.wires, shots=self.shots)
-        if self.verb: print('shots:', self.shots, 'layers:', self.layers, 'wires:', self.wires, 'dev:', self.dev)
+        # devices are built lazily on first use
+        self.dev_name = dev
+        if self.verb: print('shots:', self.shots, 'layers:', self.layers, 'wires:', self.wires, 'dev:', self.dev_name)
         
-        # quantum ansatz: default RandomLayers
-        self.ansatz = getattr(qml, ansatz)
-        if self.verb: print('ansatz:', self.ansatz)
+        # quantum ansatz: default RandomLayers (pennylane template resolved lazily)
+        self.ansatz_name = ansatz
+        if self.verb: print('ansatz:', self.ansatz_name)
         
         # weights
-        self.shape = self.ansatz.shape(*self.layers)
+        self.shape = self.ansatz.shape(*self.layers) if weights is None else np.shape(weights)
         if self.verb: print('shape:', self.shape)
         
-        weights = self.init_weights(self.shape)
+        if weights is None:
+            weights = self.init_weights(self.shape)
         self.set_weights(weights)
         if self.verb: print('weights:', self.weights)
         
-        # quantum node
-        self.init_qnodes()
+        # quantum nodes are built lazily on first use
             
+    # lazy ansatz, devices and quantum nodes; only called when not yet built (or not in older pickled models)
+    def __getattr__(self, name):
+        if name == 'ansatz' and 'ansatz_name' in self.__dict__:
+            import pennylane as qml
+            self.ansatz = getattr(qml, self.ansatz_name)
+            return self.ansatz
+        if name == 'index' and 'wires' in self.__dict__: # note -> wire
+            self.index = {note: k for k, note in enumerate(self.wires)}
+            return self.index
+        if name in ('dev', 'dev_shots') and 'dev_name' in self.__dict__:
+            self.init_devices()
+            return self.__dict__[name]
+        if name in ('qnode', 'qnode_shots', 'qnode_probs', 'qnode_models') and 'wires' in self.__dict__:
+            self.init_qnodes()
+            return self.__dict__[name]
+        if name in ('cones', 'groups', 'qnode_cones') and 'wires' in self.__dict__:
+            self.init_cones()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    # init devices
+    def init_devices(self):
+        import pennylane as qml
+        if self.sim == 'mps': # matrix product state; bond dimension bounds memory
+            self.dev = qml.device('default.tensor', wires=self.wires, method='mps', max_bond_dim=self.bond_dim)
+        else:
+            self.dev = qml.device(self.dev_name, wires=self.wires)
+        self.dev_shots = qml.device(self.dev_name, wires=self.wires, shots=self.shots)
+        if self.verb: print('init devices:', self.dev)
+
+    # drop qnodes to be rebuilt on next use
+    def drop_qnodes(self):
+        for name in ('qnode', 'qnode_shots', 'qnode_probs', 'qnode_models', 'cones', 'groups', 'qnode_cones'):
+            self.__dict__.pop(name, None)
+
+    # drop devices and qnodes, e.g., on simulation change
+    def drop_devices(self):
+        self.drop_qnodes()
+        for name in ('dev', 'dev_shots'):
+            self.__dict__.pop(name, None)
+
     # init qnode
     def init_qnodes(self):
-        self.qnode = qml.QNode(self.circuit, device=self.dev)
+        import pennylane as qml
+        self.qnode = qml.QNode(self.circuit, device=self.dev, diff_method=self.diff_method)
         self.qnode_shots = qml.QNode(self.circuit, device=self.dev_shots)
+        self.qnode_probs = qml.QNode(self.circuit_probs, device=self.dev)
+        self.qnode_models = qml.QNode(self.circuit_models, device=self.dev, diff_method=self.diff_method)
         if self.verb: print('init qnode:', self.qnode)
         
     # initialize weights
     def init_weights(self, shape):
-        return np.random.randn(*shape, requires_grad=True)
+        import pennylane.numpy as pnp
+        return pnp.random.randn(*shape, requires_grad=True)
     
     # set 
     def set_weights(self, weights):
         if self.verb: print('set weights:', weights)
         self.weights = weights
+        self.table = None # invalidate compiled table
+        self.dists = None # invalidate sampling distributions
+        self.ops = None # invalidate decomposed gates for light cones
+
+    # seed sampling engine generator; None for fresh entropy
+    def set_seed(self, seed=None):
+        if seed != None and seed <= 0:
+            seed = None
+        self.rng = np.random.default_rng(seed)
         
     # set wires
     def set_wires(self, wires):
         if self.verb: print('set wires', wires)
         self.wires = wires
+        for name in ('index', 'cones', 'groups', 'qnode_cones'):
+            self.__dict__.pop(name, None)
         self.init_qnodes()        
     
+    # basis embedding; 2-D inputs (n_notes, n_wires) are broadcasted as RX(pi) bit flips
+    def embed(self, inputs, wires=None):
+        import pennylane as qml
+        wires = self.wires if wires is None else wires
+        if np.ndim(inputs) == 1:
+            qml.BasisEmbedding(inputs, wires=wires)
+        else:
+            for k in range(len(wires)):
+                qml.RX(np.pi * inputs[:, k], wires=wires[k])
+
+    # variational ansatz; own weights unless given
+    def variational(self, weights=None):
+        weights = self.weights if weights is None else weights
+        if self.qseed == -1:
+            self.ansatz(weights=weights, wires=self.wires)
+        else: # RandomLayers
+            self.ansatz(weights=weights, wires=self.wires, seed=self.qseed)            
+
     # qcircuit
     def circuit(self, inputs, sample=False):
+        import pennylane as qml
         # basis embedding
-        qml.BasisEmbedding(inputs, wires=self.wires)
+        self.embed(inputs)
         
         # ansatz
-        if self.qseed == -1:
-            self.ansatz(weights=self.weights, wires=self.wires)
-        else: # RandomLayers
-            self.ansatz(weights=self.weights, wires=self.wires, seed=self.qseed)            
+        self.variational()
         
         # measure
         if sample:
@@ -103,40 +214,266 @@ class Qusic():
         else:
             return tuple([qml.expval(qml.PauliZ(i)) for i in self.wires])
 
-    # forward; given one-hot-encoded note
+    # qcircuit for output distribution
+    def circuit_probs(self, inputs):
+        import pennylane as qml
+        self.embed(inputs)
+        self.variational()
+        return qml.probs(wires=self.wires)
+
+    # qcircuit for broadcasted weight sets (batch, *shape) along with inputs (batch, n_wires)
+    def circuit_models(self, inputs, weights, sample=False):
+        import pennylane as qml
+        self.embed(inputs)
+        self.variational(weights)
+        if sample:
+            return qml.probs(wires=self.wires)
+        return tuple([qml.expval(qml.PauliZ(i)) for i in self.wires])
+
+    # ansatz gates on at most two wires, recorded with current (possibly trainable) weights
+    def gates(self):
+        import pennylane as qml
+        with qml.queuing.AnnotatedQueue() as queue:
+            self.variational()
+        gates = list(queue.queue)
+        with qml.QueuingManager.stop_recording():
+            while any(len(gate.wires) > 2 and gate.has_decomposition for gate in gates):
+                gates = [g for gate in gates
+                         for g in (gate.decomposition() if len(gate.wires) > 2 and gate.has_decomposition else [gate])]
+        return gates
+
+    # ansatz gates for light cones; decomposed once while weights are concrete, per call under autograd
+    def cone_gates(self):
+        if type(self.weights) is not np.ndarray:
+            return self.gates()
+        if self.__dict__.get('ops') is None:
+            self.ops = self.gates()
+        return self.ops
+
+    # backward light cone per measured wire; (cone wires, positions of gates inside)
+    # wires with the same cone share one small qnode (group: cone, gates, measured wires)
+    def init_cones(self):
+        import pennylane as qml
+        gates = self.cone_gates()
+        self.cones = list()
+        for wire in self.wires:
+            cone, keep = {wire}, list()
+            for i in reversed(range(len(gates))):
+                if cone & set(gates[i].wires):
+                    cone |= set(gates[i].wires)
+                    keep.append(i)
+            self.cones.append(([w for w in self.wires if w in cone], keep[::-1]))
+        groups = dict()
+        for wire, (cone, keep) in zip(self.wires, self.cones):
+            groups.setdefault((tuple(cone), tuple(keep)), list()).append(wire)
+        self.groups = [(list(cone), list(keep), wires) for (cone, keep), wires in groups.items()]
+        self.qnode_cones = [qml.QNode(functools.partial(self.circuit_cone, k), device=qml.device(self.dev_name, wires=cone),
+                                      diff_method=self.diff_method) for k, (cone, _, _) in enumerate(self.groups)]
+        if self.verb: print('light cones:', [len(cone) for cone, _ in self.cones], 'qnodes:', len(self.groups))
+
+    # qcircuit restricted to k-th light cone group; 2^|cone| instead of 2^n_wires amplitudes
+    def circuit_cone(self, k, inputs):
+        import pennylane as qml
+        cone, keep, wires = self.groups[k]
+        self.embed(inputs, wires=cone)
+        gates = self.cone_gates()
+        for i in keep:
+            qml.apply(gates[i])
+        return tuple([qml.expval(qml.PauliZ(w)) for w in wires])
+
+    # expval per wire through light-cone qnodes; one statevector pass if any cone spans the keyboard
+    def expval_cones(self, inputs):
+        inputs = np.asarray(inputs)
+        if max(len(cone) for cone, _ in self.cones) == len(self.wires):
+            return self.qnode(inputs)
+        outputs = dict()
+        for qnode, (cone, _, wires) in zip(self.qnode_cones, self.groups):
+            outputs.update(zip(wires, qnode(inputs[..., [self.index[w] for w in cone]])))
+        return tuple([outputs[w] for w in self.wires])
+
+    # sampling from per-wire marginals of expval (shots, n_wires) per input; correlations between wires dropped
+    def draw_marginals(self, expvals):
+        if self.rng is None:
+            self.set_seed()
+        ones = 0.5 * (1 - np.stack([np.asarray(e) for e in expvals], axis=-1)) # probability of 1
+        shape = ones.shape[:-1] + (self.shots, ones.shape[-1])
+        return (self.rng.random(shape) < ones[..., None, :]).astype(int)
+
+    # forward; given one-hot-encoded note (n_wires,) or whole melody (n_notes, n_wires)
     def __call__(self, inputs, sample=False):
         if self.verb: print('sample:', sample, 'inputs:', inputs.shape, inputs)
+        batch = np.ndim(inputs) == 2
+        if batch: # broadcasted in one pass; inputs are not trainable
+            inputs = np.asarray(inputs)
+        if batch and not sample and self.rowwise(inputs): # one basis-embedded pass per note (autograd-aware stack)
+            import pennylane as qml
+            return qml.math.stack([self(x) for x in inputs])
 
         # VQC
-        if sample:
-            outputs = self.qnode_shots(inputs, sample=sample)        
+        prof.count('qusic.notes', len(inputs) if batch else 1)
+        if self.compiled and isinstance(self.weights, np.ndarray): # concrete weights (not under autograd)
+            with prof.timer('qusic.lookup'):
+                outputs = self.lookup(inputs, sample=sample)
+        elif self.sim != 'statevector': # structured simulation of expval; samples from marginals
+            with prof.timer('qusic.' + self.sim):
+                outputs = self.expval_cones(inputs) if self.sim == 'lightcone' else self.qnode(inputs)
+            if sample:
+                outputs = self.draw_marginals(outputs)
+        elif sample and self.sampler == 'engine':
+            with prof.timer('qusic.engine'):
+                outputs = self.draw_samples(inputs)
+        elif sample:
+            with prof.timer('qusic.qnode_shots'): # one circuit execution
+                outputs = self.qnode_shots(inputs, sample=sample)        
         else:
-            outputs = self.qnode(inputs, sample=sample)        
+            with prof.timer('qusic.qnode'): # one circuit execution
+                outputs = self.qnode(inputs, sample=sample)        
+        if isinstance(outputs, (tuple, list)): # expval per wire (autograd-aware stack)
+            import pennylane as qml
+            outputs = qml.math.stack(outputs, axis=-1)
+        if batch and sample and self.shots == 1 and np.ndim(outputs) == 3: # (n_notes, 1, n_wires)
+            outputs = outputs[:, 0]
         if self.verb: print('outputs:', outputs.shape, outputs)
 
         return outputs
+
+    # autograd weights over a single note or a keyboard too wide for broadcasting under autograd
+    def rowwise(self, inputs):
+        if type(self.weights) is np.ndarray: # plain array; no pennylane import (compiled playback)
+            return False
+        import pennylane as qml
+        if qml.math.get_interface(self.weights) != 'autograd':
+            return False
+        return len(inputs) == 1 or len(self.wires) >= BROADCAST_WIRES
+
+    # K weight sets (K, *shape) of this ansatz over same inputs (n_notes, n_wires); (K, n_notes, n_wires) expval,
+    # or samples drawn by sampling engine; one broadcasted pass (RandomLayers does not broadcast weights: pass per set)
+    def evaluate(self, weights, inputs, sample=False):
+        import pennylane as qml
+        inputs = np.atleast_2d(np.asarray(inputs))
+        k, n = len(weights), len(inputs)
+        prof.count('qusic.notes', k * n)
+        stack = lambda outputs: qml.math.stack(outputs, axis=-1) if isinstance(outputs, (tuple, list)) else outputs
+        with prof.timer('qusic.qnode_models'):
+            if self.qseed == -1: # weight set per row of K * n_notes batch
+                outputs = stack(self.qnode_models(np.tile(inputs, (k, 1)), qml.math.repeat(weights, n, axis=0), sample=sample))
+                outputs = qml.math.reshape(outputs, (k, n, -1))
+            else:
+                outputs = qml.math.stack([stack(self.qnode_models(inputs, w, sample=sample)) for w in weights])
+        if not sample:
+            return outputs
+        outputs = self.sample_probs(np.asarray(outputs))
+        return outputs[:, :, 0] if self.shots == 1 else outputs
     
+    # weights hash to key compiled table
+    def weights_hash(self):
+        weights = np.ascontiguousarray(self.weights)
+        return hashlib.sha1(weights.tobytes()).hexdigest() + str(weights.shape)
+
+    # compile ansatz into lookup table; row i is output distribution/expval for input basis state i
+    def compile(self):
+        key = self.weights_hash()
+        if self.table is not None and self.table_key == key:
+            return self.table
+        if self.verb: print('compiling:', key)
+
+        # basis embedding only selects one column of ansatz unitary
+        import pennylane as qml
+        with prof.timer('qusic.compile'):
+            unitary = qml.matrix(self.variational, wire_order=self.wires)()
+        probs = np.abs(np.asarray(unitary).T) ** 2 # (inputs, outputs)
+        bits = self.index2basis(np.arange(len(probs)))
+        expval = probs @ (1 - 2 * bits) # PauliZ per wire
+        self.table = {'probs': probs, 'expval': expval}
+        self.table_key = key
+        return self.table
+
+    # basis (..., n_wires) to basis-state index; wire 0 is most significant
+    def basis2index(self, basis):
+        n = len(self.wires)
+        return np.asarray(basis, dtype=int) @ (2 ** np.arange(n - 1, -1, -1))
+
+    # basis-state index to basis (..., n_wires)
+    def index2basis(self, index):
+        n = len(self.wires)
+        return (np.asarray(index)[..., None] >> np.arange(n - 1, -1, -1)) & 1
+
+    # forward through compiled table lookups
+    def lookup(self, inputs, sample=False):
+        table = self.compile()
+        index = self.basis2index(inputs)
+        if not sample:
+            return table['expval'][index]
+
+        return self.draw_samples(inputs)
+
+    # output distributions of basis-state indices; simulated once per distinct input and weights
+    def distributions(self, index):
+        if self.compiled and isinstance(self.weights, np.ndarray):
+            return self.compile()['probs'][index]
+        if self.dists is None:
+            self.dists = dict()
+        unique, inverse = np.unique(index, return_inverse=True)
+        todo = [i for i in unique if i not in self.dists]
+        if len(todo) > 0:
+            inputs = self.index2basis(np.array(todo))
+            with prof.timer('qusic.qnode_probs'): # one circuit execution
+                probs = np.asarray(self.qnode_probs(inputs)).reshape(len(todo), -1)
+            self.dists.update(zip(todo, probs))
+        probs = np.stack([self.dists[i] for i in unique])
+        return probs[inverse.reshape(np.shape(index))]
+
+    # sampling engine; one multinomial draw over all inputs from seeded generator, (shots, n_wires) per input
+    def draw_samples(self, inputs):
+        return self.sample_probs(self.distributions(self.basis2index(inputs)))
+
+    # shots per distribution (..., 2^n_wires); (..., shots, n_wires)
+    def sample_probs(self, probs):
+        if self.rng is None:
+            self.set_seed()
+        probs = probs / probs.sum(axis=-1, keepdims=True) # guard round-off
+        counts = self.rng.multinomial(self.shots, probs) # (..., 2^n_wires)
+
+        # counts to shots of outcomes; shuffled within each input
+        shape = probs.shape[:-1]
+        outcomes = np.repeat(np.tile(np.arange(probs.shape[-1]), int(np.prod(shape))), counts.ravel())
+        outcomes = self.rng.permuted(outcomes.reshape(*shape, self.shots), axis=-1)
+        return self.index2basis(outcomes)
+
     # notes list to wires basis; ['C4', 'D4'] -> [1,1,0,0,0,0,0]
     def notes2basis(self, notes):
-        basis = np.zeros(len(self.wires), dtype=int)
-        # search note in wires
-        for k in range(len(self.wires)):
-            if self.wires[k] in notes:
-                basis[k] = 1
-        return basis
+        return self.encode([notes])[0]
     
     # wires basis to notes list; [1,1,0,0,0,0,0] -> ['C4', 'D4']
     def basis2notes(self, basis):
-        notes = list()
-        # search wire in basis
-        for k in range(len(basis)):
-            if basis[k]:
-                notes.append(self.wires[k])
-        return notes
+        return self.decode(np.asarray(basis)[None])[0]
+
+    # score (list of note lists; a string is one note) to basis matrix (n, n_wires); notes off wires (e.g., '-') ignored
+    def encode(self, score, dtype=np.int8):
+        rows, cols = list(), list()
+        for n, notes in enumerate(score):
+            for note in [notes] if isinstance(notes, str) else notes:
+                k = self.index.get(note)
+                if k is not None:
+                    rows.append(n)
+                    cols.append(k)
+        basis = np.zeros((len(score), len(self.wires)), dtype=dtype)
+        basis[rows, cols] = 1
+        return basis
+
+    # basis matrix (n, n_wires) to score (list of note lists)
+    def decode(self, basis):
+        rows, cols = np.nonzero(basis)
+        notes = np.asarray(self.wires, dtype=object)[cols]
+        return [list(line) for line in np.split(notes, np.searchsorted(rows, np.arange(1, len(basis))))]
     
     # draw
     def draw(self, inputs=None):
-        drawer = qml.draw(self.qnode, expansion_strategy='device')
+        import pennylane as qml
+        try:
+            drawer = qml.draw(self.qnode, level='device')
+        except TypeError: # older pennylane
+            drawer = qml.draw(self.qnode, expansion_strategy='device')
         if inputs is None:
             inputs = np.zeros(len(self.wires))
         print(drawer(inputs))
@@ -144,12 +481,29 @@ class Qusic():
         spec = qml.specs(self.qnode)(inputs)
         print('# spec', spec)
     
-    # save model    
+    # model config to rebuild from
+    def config(self):
+        dev = self.dev_name if self.dev_name != None else getattr(self.dev, 'short_name', self.dev.name)
+        return {'layers': list(self.layers), 'wires': list(self.wires), 'dev': dev,
+                'ansatz': self.ansatz_name or self.ansatz.__name__, 'shots': self.shots, 'qseed': self.qseed,
+                'compiled': self.compiled, 'diff_method': self.diff_method, 'sampler': self.sampler,
+                'sim': self.sim, 'bond_dim': self.bond_dim}
+
+    # save model; compact versioned npz (config + weights) for .npz, dill pickle otherwise
     def save(self, fname='model.pkl', path=None):
         if path != None:
             os.makedirs(path, exist_ok=True)
             fname = os.path.join(path, fname)
         if self.verb: print('saving model:', fname)
+        if fname.endswith('.npz'):
+            # uncompressed; arrays are read lazily per key without unpickling
+            arrays = {'version': FORMAT_VERSION, 'config': json.dumps(self.config()), 'weights': np.asarray(self.weights)}
+            if self.compiled: # serve lookups without pennylane after loading
+                table = self.compile()
+                arrays.update(table_key=self.table_key, table_probs=table['probs'], table_expval=table['expval'])
+            np.savez(fname, **arrays)
+            return
+        import dill as pickle
         with open(fname, 'wb') as file:
             pickle.dump(self, file)
     
@@ -166,8 +520,8 @@ class Qusic():
         if path != None:
             fname = os.path.join(path, fname)
         if self.verb: print('loading model:', fname)
-        with open(fname, 'rb') as file:
-            model = pickle.load(file)
+        model = Qusic.load_model(fname, verb=self.verb)
+        self.__dict__.clear()
         self.__dict__.update(model.__dict__)
 
     def load_weights(self, fname='weights.npy', path=None):
@@ -175,14 +529,26 @@ class Qusic():
             fname = os.path.join(path, fname)
         if self.verb: print('loading weights:', fname)
         with open(fname, 'rb') as file:
-            self.weights = np.load(file)
+            self.set_weights(np.load(file))
 
-    # load model (not for self but cls)
+    # load model (not for self but cls); compact npz or dill pickle
     @classmethod
     def load_model(cls, fname='model.pkl', path=None, verb=False):
         if path != None:
             fname = os.path.join(path, fname)
         if verb: print('loading model:', fname)
+        if fname.endswith('.npz'):
+            with np.load(fname, allow_pickle=False) as file:
+                version = int(file['version'])
+                if version > FORMAT_VERSION:
+                    raise ValueError(f'unsupported model format version {version}: {fname}')
+                config = json.loads(str(file['config']))
+                model = cls(**config, weights=np.array(file['weights']), verb=verb)
+                if 'table_key' in file.files: # compiled table saved with model
+                    model.table = {'probs': file['table_probs'], 'expval': file['table_expval']}
+                    model.table_key = str(file['table_key'])
+            return model
+        import dill as pickle
         with open(fname, 'rb') as file:
             model = pickle.load(file)
         return model
@@ -194,9 +560,19 @@ def get_model(args, verb=False):
         model = Qusic(layers=args.layers, wires=args.wires, 
                       dev=args.dev, ansatz=args.ansatz, 
                       shots=args.shots, qseed=args.qseed,
-                      verb=verb)
+                      compiled=args.compiled, diff_method=args.diff_method,
+                      sampler=args.sampler, sim=args.sim, bond_dim=args.bond_dim, verb=verb)
     else:
         model = Qusic.load_model(args.load, verb=verb)
+        model.compiled = model.compiled or args.compiled
+        model.sampler = args.sampler
+        if model.sim != args.sim or model.bond_dim != args.bond_dim:
+            model.sim, model.bond_dim = args.sim, args.bond_dim
+            model.drop_devices()
+        if model.diff_method != args.diff_method:
+            model.diff_method = args.diff_method
+            model.drop_qnodes()
+    model.set_seed(getattr(args, 'seed', None)) # reproducible sampling under --seed
     if verb: print('get_model:', model)
     return model
 
@@ -213,6 +589,7 @@ if __name__ == '__main__':
 
     # seed simulation    
     seeding(args.seed, verb=args.verb)
+    prof.setup(args, verb=args.verb)
 
     # get qusic model
     model = get_model(args, verb=args.verb)
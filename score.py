@@ -0,0 +1,196 @@
+# (c) Toshiaki Koike-Akino, 2022
+# score reader; streams melody steps (note lists) lazily from text or standard midi files
+# text score: whitespace-separated steps, chord notes joined by '+', '-' for break, '#' comments
+#   e.g., C4 C4 G4 G4 A4 A4 G4 - C4+E4+G4
+# midi score: note-on events quantized onto a step grid (quarter note by default); empty steps are breaks
+import argparse
+import struct
+import heapq
+import itertools
+
+NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# args to inherit
+def score_args(parser):
+    parser = parser.add_argument_group('score')
+    parser.add_argument('--score', default=None, type=str, help='score file to play (.mid/.midi or text)')
+    parser.add_argument('--grid', default=1, type=int, help='midi steps per quarter note')
+    parser.add_argument('--chunk', default=256, type=int, help='score steps per batched model call')
+
+# midi note number to name; 60 -> C4
+def midi2note(number, octave=True):
+    name = NOTES[number % 12]
+    return f'{name}{number // 12 - 1}' if octave else name
+
+# note name to midi note number; C4 -> 60 (octave 4 if not given)
+def note2midi(note):
+    name = note.rstrip('0123456789')
+    octave = int(note[len(name):]) if len(name) < len(note) else 4
+    return NOTES.index(name) + 12 * (octave + 1)
+
+# drop octave from note name; C4 -> C
+def strip(note):
+    return note if note == '-' else note.rstrip('0123456789')
+
+# text score steps
+def read_text(fname, octave=True):
+    with open(fname) as file:
+        for line in file:
+            for token in line.split('#')[0].split():
+                notes = token.split('+')
+                yield notes if octave else [strip(note) for note in notes]
+
+# variable-length quantity from byte stream
+def read_varlen(file):
+    value = 0
+    while True:
+        byte = file.read(1)[0]
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value
+
+# track chunk offsets and lengths; (division, [(offset, length), ...])
+def read_header(fname):
+    with open(fname, 'rb') as file:
+        kind, length = struct.unpack('>4sI', file.read(8))
+        if kind != b'MThd':
+            raise ValueError(f'not a midi file: {fname}')
+        form, ntracks, division = struct.unpack('>HHH', file.read(6))
+        if division & 0x8000:
+            raise ValueError(f'smpte time division not supported: {fname}')
+        file.seek(8 + length)
+        tracks = list()
+        while len(tracks) < ntracks:
+            head = file.read(8)
+            if len(head) < 8:
+                break
+            kind, length = struct.unpack('>4sI', head)
+            if kind == b'MTrk':
+                tracks.append((file.tell(), length))
+            file.seek(length, 1)
+    return division, tracks
+
+# note-on events (tick, number) of one track in time order, then end of track (tick, -1); percussion channel skipped
+def read_track(fname, offset, length):
+    with open(fname, 'rb') as file:
+        file.seek(offset)
+        tick, running = 0, 0
+        while file.tell() < offset + length:
+            tick += read_varlen(file)
+            byte = file.read(1)[0]
+            if byte >= 0x80:
+                status, data = byte, None
+                if byte < 0xf0: # channel status kept for running status
+                    running = byte
+            else: # running status
+                status, data = running, byte
+            if status == 0xff: # meta event
+                kind = file.read(1)[0]
+                file.seek(read_varlen(file), 1)
+                if kind == 0x2f: # end of track; its tick keeps trailing breaks
+                    yield tick, -1
+                    return
+            elif status in (0xf0, 0xf7): # sysex
+                file.seek(read_varlen(file), 1)
+            else: # channel message
+                if data is None:
+                    data = file.read(1)[0]
+                kind, channel = status & 0xf0, status & 0x0f
+                if kind not in (0xc0, 0xd0): # two data bytes
+                    velocity = file.read(1)[0]
+                    if kind == 0x90 and velocity > 0 and channel != 9:
+                        yield tick, data
+
+# midi score steps; tracks merged by time, note-ons quantized onto grid steps per quarter note
+def read_midi(fname, octave=True, grid=1):
+    division, tracks = read_header(fname)
+    ticks = division / grid # ticks per step
+    events = heapq.merge(*[read_track(fname, offset, length) for offset, length in tracks])
+    step, notes, end = 0, list(), 0
+    for tick, number in events:
+        if number < 0: # end of track
+            end = max(end, tick)
+            continue
+        k = int(tick / ticks + 0.5)
+        if k > step:
+            if len(notes) > 0:
+                yield notes
+                step += 1
+            for _ in range(step, k): # breaks
+                yield ['-']
+            step, notes = k, list()
+        note = midi2note(number, octave=octave)
+        if note not in notes:
+            notes.append(note)
+    if len(notes) > 0:
+        yield notes
+        step += 1
+    for _ in range(step, int(end / ticks + 0.5)): # trailing breaks up to end of track
+        yield ['-']
+
+# score steps from file by extension
+def read(fname, octave=True, grid=1):
+    if fname.lower().endswith(('.mid', '.midi')):
+        return read_midi(fname, octave=octave, grid=grid)
+    return read_text(fname, octave=octave)
+
+# steps into lists of at most size steps
+def chunks(steps, size=256):
+    steps = iter(steps)
+    while True:
+        chunk = list(itertools.islice(steps, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+# write variable-length quantity
+def varlen(value):
+    data = [value & 0x7f]
+    value >>= 7
+    while value > 0:
+        data.append(0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(data[::-1])
+
+# write score steps as single-track midi; one quarter note per step, e.g., to make test scores
+def write_midi(fname, steps, division=480, velocity=96):
+    track, delta = bytearray(), 0
+    for notes in steps:
+        numbers = [note2midi(note) for note in notes if note != '-']
+        for k, number in enumerate(numbers):
+            track += varlen(delta if k == 0 else 0) + bytes([0x90, number, velocity])
+        for k, number in enumerate(numbers):
+            track += varlen(division if k == 0 else 0) + bytes([0x80, number, 0])
+        delta = 0 if len(numbers) > 0 else delta + division
+    track += varlen(delta) + bytes([0xff, 0x2f, 0x00])
+    with open(fname, 'wb') as file:
+        file.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, division))
+        file.write(b'MTrk' + struct.pack('>I', len(track)) + track)
+
+# write score steps as text
+def write_text(fname, steps, width=8):
+    with open(fname, 'w') as file:
+        for k, notes in enumerate(steps):
+            file.write('+'.join(notes) + ('\n' if (k + 1) % width == 0 else ' '))
+
+# example args
+def get_args():
+    parser = argparse.ArgumentParser(__file__)
+    parser.add_argument('--verb', action='store_true', help='verbose')
+    parser.add_argument('--out', default='twinkle.mid', type=str, help='score file to write (.mid/.midi or text)')
+    score_args(parser)
+    return parser.parse_args()
+
+# example main; write twinkle score and read it back
+if __name__ == '__main__':
+    import twinkle
+    args = get_args()
+
+    steps = [[note if note == '-' else f'{note}4'] for note in twinkle.get_score(octave=0)]
+    if args.out.lower().endswith(('.mid', '.midi')):
+        write_midi(args.out, steps)
+    else:
+        write_text(args.out, steps)
+    print('score:', args.out)
+    for chunk in chunks(read(args.out, grid=args.grid), args.chunk):
+        print(chunk)
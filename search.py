@@ -0,0 +1,116 @@
+# (c) Toshiaki Koike-Akino, 2022
+# search of non-interfering chord ansatz sets; ordered chord subsets scored by melody notes mapped to intended chords
+# depth-first over chord sequences (distinct roots); each prefix simulated once as bit-level states shared by its extensions
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import heapq
+import os
+import chord
+
+# args
+def get_args():
+    parser = argparse.ArgumentParser(__file__)
+    parser.add_argument('--verb', action='store_true', help='verbose')
+
+    # search args
+    search_args(parser)
+
+    return parser.parse_args()
+
+# search args
+def search_args(parser):
+    parser = parser.add_argument_group('search')
+    parser.add_argument('--wires', default=chord.get_wires(), type=str, nargs='+', help='wire layout (notes)')
+    parser.add_argument('--kinds', default=list(chord.INTERVALS), type=str, nargs='+',
+                        choices=list(chord.INTERVALS), help='chord kinds to consider')
+    parser.add_argument('--max-chords', default=4, type=int, help='largest chord set')
+    parser.add_argument('--top', default=10, type=int, help='best sets to report')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int, help='parallel processes')
+
+# candidate chords on wire layout; every note on a wire
+def get_candidates(wires, kinds):
+    harmony = chord.get_harmony()
+    return [(name, notes) for name, notes in harmony.items()
+            if any(name == notes[0] + kind for kind in kinds) and all(note in wires for note in notes)]
+
+# chord set search on wire layout; states are outputs of one-hot melody inputs (one per wire)
+class Search():
+    def __init__(self, wires, candidates, max_chords=4, top=10):
+        self.wires = wires
+        self.candidates = candidates
+        self.max_chords = max_chords
+        self.top = top
+        self.index = {wire: k for k, wire in enumerate(wires)}
+        self.inputs = tuple(int(s) for s in chord.basis2state([[int(j == k) for j in range(len(wires))]
+                                                             for k in range(len(wires))]))
+        self.targets = [int(chord.basis2state([int(w in notes) for w in wires])) for _, notes in candidates]
+        self.roots = [self.index[notes[0]] for _, notes in candidates]
+        # chord as one controlled flip (root bit, other note bits), same as its CNOT fan-out by chord.permute
+        self.masks = [(self.inputs[root], target ^ self.inputs[root]) for root, target in zip(self.roots, self.targets)]
+
+    # states after one more chord
+    def step(self, states, c):
+        control, flip = self.masks[c]
+        return tuple(s ^ flip if s & control else s for s in states)
+
+    # (matched, broken, clean); roots of chosen chords mapping to chord, others, other notes left alone
+    def score(self, states, chosen):
+        matched = sum(states[self.roots[c]] == self.targets[c] for c in chosen)
+        roots = {self.roots[c] for c in chosen}
+        clean = sum(states[k] == self.inputs[k] for k in range(len(states)) if k not in roots)
+        return matched, len(chosen) - matched, clean
+
+    # depth-first over chord sequences from prefix; distinct roots; states seen with same chord set skipped
+    def run(self, prefix):
+        best, seen = list(), set()
+        def visit(states, chosen):
+            key = (frozenset(chosen), states)
+            if key in seen:
+                return
+            seen.add(key)
+            matched, broken, clean = self.score(states, chosen)
+            item = ((matched, -broken, clean, -len(chosen)), [self.candidates[c][0] for c in chosen])
+            if len(best) < self.top:
+                heapq.heappush(best, item)
+            else:
+                heapq.heappushpop(best, item)
+            if len(chosen) == self.max_chords:
+                return
+            roots = {self.roots[c] for c in chosen}
+            for c in range(len(self.candidates)):
+                if self.roots[c] not in roots:
+                    visit(self.step(states, c), chosen + [c])
+        states = self.inputs
+        for c in prefix:
+            states = self.step(states, c)
+        visit(states, list(prefix))
+        return best, len(seen)
+
+# one search branch in worker process
+def run(wires, candidates, max_chords, top, prefix):
+    return Search(wires, candidates, max_chords=max_chords, top=top).run(prefix)
+
+# best chord sets over all branches (one per first chord)
+def search(args):
+    candidates = get_candidates(args.wires, args.kinds)
+    print('wires:', args.wires, 'candidates:', len(candidates))
+    if args.verb: print([name for name, _ in candidates])
+    best, nodes = list(), 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run, args.wires, candidates, args.max_chords, args.top, [c])
+                   for c in range(len(candidates))]
+        for future in futures:
+            branch, seen = future.result()
+            best.extend(branch)
+            nodes += seen
+    best = heapq.nlargest(args.top, best)
+    print('visited:', nodes)
+    for (matched, broken, clean, size), names in best:
+        print(f'{matched:2d} matched {-broken:2d} broken {clean:2d} clean:', ' '.join(names))
+    return [{'chords': names, 'matched': matched, 'broken': -broken, 'clean': clean}
+            for (matched, broken, clean, size), names in best]
+
+if __name__ == '__main__':
+    args = get_args()
+
+    search(args)
@@ -0,0 +1,111 @@
+# (c) Toshiaki Koike-Akino, 2022
+# parallel qaestro training sweeps over (ansatz, layers, lr, opt, seed)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import argparse
+import itertools
+import copy
+import time
+import csv
+import os
+import qaestro
+
+# args
+def get_args():
+    parser = argparse.ArgumentParser(__file__)
+    # general args (as qaestro)
+    parser.add_argument('--verb', action='store_true', help='verbose')
+    parser.add_argument('--seed', default=1, type=int, help='seed for main')
+    parser.add_argument('--showfig', action='store_true', help='show figure')
+
+    # qaestro args as base of every run
+    qaestro.add_args(parser)
+
+    # sweep args
+    sweep_args(parser)
+
+    return parser.parse_args()
+
+# sweep grid args
+def sweep_args(parser):
+    parser = parser.add_argument_group('sweep')
+    parser.add_argument('--ansatzes', default=['BasicEntanglerLayers', 'StronglyEntanglingLayers', 'RandomLayers'],
+                        type=str, nargs='+', help='ansatzes to sweep')
+    parser.add_argument('--depths', default=[2, 7, 32, 64], type=int, nargs='+', help='ansatz layers to sweep')
+    parser.add_argument('--lrs', default=[0.01], type=float, nargs='+', help='learning rates to sweep')
+    parser.add_argument('--opts', default=['AdamOptimizer'], type=str, nargs='+', help='optimizers to sweep')
+    parser.add_argument('--seeds', default=[1], type=int, nargs='+', help='seeds to sweep')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int, help='parallel processes')
+    parser.add_argument('--out', default='sweeps', type=str, help='sweep output directory')
+
+# grid of per-run args; plain namespaces only, picklable to workers
+def get_grid(args):
+    grid = list()
+    for ansatz, depth, lr, opt, seed in itertools.product(args.ansatzes, args.depths, args.lrs, args.opts, args.seeds):
+        run = copy.deepcopy(args)
+        run.ansatz = ansatz
+        run.layers = [depth, len(args.wires)]
+        run.lr = lr
+        run.opt = opt
+        run.seed = seed
+        run.name = f'{ansatz}_{depth}_{len(args.wires)}_{opt}_lr{lr}_s{seed}'
+        run.models = os.path.join(args.out, 'models')
+        run.plots = os.path.join(args.out, 'plots')
+        run.save = 'npz' # compact model, no pickling of qnodes/devices
+        run.showfig = False
+        grid.append(run)
+    return grid
+
+# one training run in worker process; returns plain summary
+def run(args):
+    import matplotlib
+    matplotlib.use('Agg') # headless workers
+
+    logs = os.path.join(args.out, 'logs')
+    os.makedirs(logs, exist_ok=True)
+    start = time.time()
+    with open(os.path.join(logs, f'{args.name}.log'), 'w') as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            model, loss = qaestro.main(args)
+    loss = [float(l) for l in loss]
+    tail = loss[-max(1, len(loss) // 10):] # last 10% of epochs
+    return {'name': args.name, 'ansatz': args.ansatz, 'layers': args.layers[0], 'lr': args.lr,
+            'opt': args.opt, 'seed': args.seed, 'final_loss': sum(tail) / len(tail), 'min_loss': min(loss),
+            'sec': time.time() - start, 'model': os.path.join(args.models, f'{args.name}.npz')}
+
+# summary table
+def summarize(results, fname):
+    keys = ['name', 'ansatz', 'layers', 'lr', 'opt', 'seed', 'final_loss', 'min_loss', 'sec', 'model']
+    with open(fname, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=keys)
+        writer.writeheader()
+        writer.writerows(results)
+    for r in results:
+        print(f"{r['name']:>60s} final {r['final_loss']:.4f} min {r['min_loss']:.4f} {r['sec']:8.1f} sec")
+
+# main
+def main(args):
+    if args.verb: print('# args:', args)
+
+    grid = get_grid(args)
+    print('runs:', len(grid), 'workers:', args.workers)
+    os.makedirs(args.out, exist_ok=True)
+
+    results = list()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run, r): r.name for r in grid}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+                if args.verb: print('done:', futures[future])
+            except Exception as e:
+                print('failed:', futures[future], e)
+
+    results.sort(key=lambda r: r['final_loss'])
+    summarize(results, os.path.join(args.out, 'summary.csv'))
+    return results
+
+if __name__ == '__main__':
+    args = get_args()
+
+    main(args)
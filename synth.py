@@ -1,11 +1,192 @@
 # Toshiaki Koike-Akino, 2022
 # wrapping synthesizer in https://github.com/joaocarvalhoopen/Synthesizer_in_Python
-# creating wave files in Sounds/{sound}/{note}{octave}.wav
-import Synthesizer_in_Python.synthesizer as syn
+# creating wave files in Sounds/{sound}/{note}{octave}.wav, or one packed bank (.npy with .json index of offsets)
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import numpy as np
+import wave
+import json
 import os
 import argparse
+import prof
 
-# create wav
+# synthesizer submodule; imported lazily on first synthesis
+def get_syn():
+    import Synthesizer_in_Python.synthesizer as syn
+    return syn
+
+# generate function; cached if cache given
+def get_generate(cache=None):
+    return get_syn().generate if cache is None else cache.generate
+
+# write float signal in [-1, 1] as 16-bit PCM mono wav
+def write_wav(fname, signal, rate):
+    with wave.open(fname, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(int(rate))
+        file.writeframes(to_pcm(signal))
+
+# chunked 16-bit PCM mono wav writer; frames are appended as blocks arrive
+class WavWriter():
+    def __init__(self, fname, rate):
+        self.file = wave.open(fname, 'wb')
+        self.file.setnchannels(1)
+        self.file.setsampwidth(2)
+        self.file.setframerate(int(rate))
+        self.frames = 0
+
+    def write(self, signal):
+        with prof.timer('wav.write'):
+            self.file.writeframes(to_pcm(signal))
+        self.frames += len(signal)
+
+    def close(self):
+        self.file.close() # patches header sizes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# float signal to 16-bit PCM bytes
+def to_pcm(signal):
+    return (np.clip(signal, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+# read PCM mono wav to float signal; None if not readable at rate
+def read_wav(fname, rate=None):
+    try:
+        with wave.open(fname, 'rb') as file:
+            if file.getnchannels() != 1 or file.getsampwidth() != 2:
+                return None
+            if rate is not None and file.getframerate() != int(rate):
+                return None
+            frames = file.readframes(file.getnframes())
+    except (OSError, EOFError, wave.Error):
+        return None
+    return np.frombuffer(frames, dtype='<i2') / 32767.0
+
+# bank entry key, as wav layout; piano/C4
+def bank_key(sound, note, octave):
+    return f'{sound}/{note}{octave}'
+
+# bank index file next to packed samples; Sounds/bank.npy -> Sounds/bank.json
+def bank_index(fname):
+    return os.path.splitext(fname)[0] + '.json'
+
+# write packed bank; signals {key: signal} concatenated as float32, index of [offset, length] per key
+def write_bank(fname, signals, rate, duration):
+    entries, offset = dict(), 0
+    for key, signal in signals.items():
+        entries[key] = [offset, len(signal)]
+        offset += len(signal)
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    np.save(fname, np.concatenate([np.asarray(signal, dtype=np.float32) for signal in signals.values()]))
+    with open(bank_index(fname), 'w') as file:
+        json.dump({'rate': rate, 'duration': duration, 'entries': entries}, file)
+
+# packed sample bank; memory-mapped once, notes sliced zero-copy (read-only views)
+class Bank():
+    def __init__(self, fname):
+        self.fname = fname
+        with open(bank_index(fname)) as file:
+            index = json.load(file)
+        self.rate = index['rate']
+        self.duration = index['duration']
+        self.entries = index['entries']
+        self.data = np.load(fname, mmap_mode='r')
+
+    # note signal; None if not in bank or not matching rate/duration
+    def get(self, sound, note, octave, duration=None, rate=None):
+        entry = self.entries.get(bank_key(sound, note, octave))
+        if entry is None or (rate is not None and int(rate) != int(self.rate)):
+            return None
+        offset, length = entry
+        if duration is not None and length != int(round(duration * self.rate)):
+            return None
+        return self.data[offset:offset + length]
+
+# waveform cache; bounded in-memory LRU with optional packed bank and on-disk tier in {path}/{sound}/{note}{octave}.wav
+class Cache():
+    def __init__(self, size=64, path=None, rate=44.1e3, bank=None, verb=False):
+        self.size = size
+        self.path = path # e.g., 'Sounds' as synthesized by main; None for memory only
+        self.rate = rate
+        self.bank = bank # Bank, checked before path
+        self.verb = verb
+        self.waves = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # same as syn.generate, but cached
+    def generate(self, sound, note, octave, duration):
+        key = (sound, note, octave, duration, self.rate)
+        if key in self.waves:
+            prof.count('synth.cache_hit')
+            self.hits += 1
+            self.waves.move_to_end(key)
+            return self.waves[key]
+        self.misses += 1
+
+        signal = self.load(sound, note, octave, duration)
+        if signal is None:
+            with prof.timer('synth.generate'):
+                signal = get_syn().generate(sound, note, octave, duration)
+            self.store(signal, sound, note, octave)
+
+        self.waves[key] = signal
+        if len(self.waves) > self.size: # evict least recently used
+            self.waves.popitem(last=False)
+        return signal
+
+    # wav file name in bank layout
+    def fname(self, sound, note, octave):
+        return os.path.join(self.path, sound, f'{note}{octave}.wav')
+
+    # bank then disk tier; reuse only if length matches the requested duration
+    def load(self, sound, note, octave, duration):
+        if self.bank is not None:
+            signal = self.bank.get(sound, note, octave, duration, rate=self.rate)
+            if signal is not None:
+                prof.count('synth.bank_hit')
+                return signal
+        if self.path is None:
+            return None
+        fname = self.fname(sound, note, octave)
+        with prof.timer('wav.read'):
+            signal = read_wav(fname, rate=self.rate)
+        if signal is None or len(signal) != int(round(duration * self.rate)):
+            return None
+        if self.verb: print('#loading', fname)
+        return signal
+
+    # disk tier; never overwrite existing bank files (e.g., other durations)
+    def store(self, signal, sound, note, octave):
+        if self.path is None:
+            return
+        fname = self.fname(sound, note, octave)
+        if os.path.exists(fname):
+            return
+        if self.verb: print('#storing', fname)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        write_wav(fname, signal, self.rate)
+
+# cache from args
+def get_cache(args, verb=False):
+    bank = Bank(args.bank) if args.bank != None else None
+    return Cache(size=args.cache_size, path=args.cache_path, rate=args.rate, bank=bank, verb=verb)
+
+# one note in worker process; saved as wav if fname given, else returned for packing
+def make(sound, note, octave, duration, rate, fname=None):
+    syn = get_syn()
+    signal = syn.generate(sound, note, octave, duration)
+    if fname is None:
+        return np.asarray(signal, dtype=np.float32)
+    syn.writeArrayToWavFilename(signal, rate, fname)
+    return fname
+
+# create wav files, or one packed bank; notes generated in process pool
 def main(args, verb=True):
     sounds = args.sounds
     octaves = args.octaves
@@ -13,16 +194,24 @@ def main(args, verb=True):
     rate = args.rate
     notes = args.notes
 
-    for sound in sounds:
-        for octave in octaves:
-            for note in notes:
-                path = f'Sounds/{sound}'
-                os.makedirs(path, exist_ok=True)
-                fname = f'{path}/{note}{octave}.wav'
+    jobs = [(sound, note, octave) for sound in sounds for octave in octaves for note in notes]
+    if args.bank == None:
+        for sound in sounds:
+            os.makedirs(f'Sounds/{sound}', exist_ok=True)
+        fnames = [f'Sounds/{sound}/{note}{octave}.wav' for sound, note, octave in jobs]
+    else:
+        fnames = [None] * len(jobs)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = pool.map(make, *zip(*jobs), [duration] * len(jobs), [rate] * len(jobs), fnames)
+        if args.bank == None:
+            for fname in results:
                 if verb: print('#saving', fname)
+            return
+        signals = {bank_key(*job): signal for job, signal in zip(jobs, results)}
 
-                signal = syn.generate(sound, note, octave, duration)
-                syn.writeArrayToWavFilename(signal, rate, fname)
+    write_bank(args.bank, signals, rate, duration)
+    if verb: print('#saving', args.bank, len(signals), 'notes')
 
 # args to inherit
 def add_args(parser):
@@ -36,6 +225,17 @@ def add_args(parser):
     parser.add_argument('--duration', default=1.0, type=float, help='sound duration (sec)')
     parser.add_argument('--octaves', default=[4], type=int, nargs='+',
                         help='sound octave')
+    parser.add_argument('--workers', default=os.cpu_count(), type=int, help='parallel note generators')
+    parser.add_argument('--bank', default=None, type=str,
+                        help='packed bank to write, e.g., Sounds/bank.npy (with Sounds/bank.json index), instead of wav files')
+
+# cache args to inherit
+def cache_args(parser):
+    parser = parser.add_argument_group('cache')
+    parser.add_argument('--cache-size', default=64, type=int, help='number of waveforms kept in memory')
+    parser.add_argument('--cache-path', default=None, type=str,
+                        help='on-disk waveform tier, e.g., Sounds (reusing {sound}/{note}{octave}.wav)')
+    parser.add_argument('--bank', default=None, type=str, help='packed bank tier from synth.py --bank, e.g., Sounds/bank.npy')
 
 # example args
 def get_args():
@@ -1,7 +1,7 @@
 # Toshiaki Koike-Akino, 2022
 # inspired by https://pyshine.com/How-to-play-piano-using-Python/
 from threading import Thread
-import pygame as pg
+import numpy as np
 import time
 import argparse
 import os
@@ -11,6 +11,8 @@ def add_args(parser):
     parser = parser.add_argument_group('twinkle')
     #parser.add_argument('--sound', default='piano', type=str, help='sound folder in path')
     parser.add_argument('--path', default='Sounds/piano', type=str, help='sound path')
+    parser.add_argument('--bank', default=None, type=str, help='packed bank from synth.py --bank, instead of path')
+    parser.add_argument('--sound', default='piano', type=str, help='sound in bank')
     parser.add_argument('--duration', default=0.4, type=float, help='sound duration')
 
 def get_args():
@@ -34,6 +36,7 @@ def get_score(octave=4):
 
 # play note
 def play_notes(notePath, duration):
+    import pygame as pg # only when playing
     #time.sleep(duration)
     try:
         pg.mixer.Sound(notePath).play()
@@ -42,22 +45,94 @@ def play_notes(notePath, duration):
     time.sleep(duration)
     #print(notePath)
 
-# init pygame mixer
-def init(num_channels=10):
-    pg.mixer.init()
+# play note signal from bank; silent if not in bank
+def play_signal(signal, duration):
+    import pygame as pg # only when playing
+    if signal is not None:
+        channels = pg.mixer.get_init()[2]
+        pcm = (np.clip(signal, -1.0, 1.0) * 32767).astype(np.int16)
+        if channels > 1:
+            pcm = np.repeat(pcm[:, None], channels, axis=1)
+        pg.mixer.Sound(buffer=pcm.tobytes()).play()
+    time.sleep(duration)
+
+# init pygame mixer; mono at rate for raw signals
+def init(num_channels=10, rate=None):
+    import pygame as pg
+    if rate is None:
+        pg.mixer.init()
+    else:
+        pg.mixer.init(frequency=int(rate), size=-16, channels=1)
     pg.init()
     pg.mixer.set_num_channels(num_channels)
 
+# real-time sink; float blocks queued on one mixer channel for gapless playback
+class Sink():
+    def __init__(self, rate=44.1e3):
+        import pygame as pg
+        self.pg = pg
+        pg.mixer.init(frequency=int(rate), size=-16, channels=1)
+        self.channels = pg.mixer.get_init()[2]
+        self.channel = pg.mixer.Channel(0)
+        
+    def play(self, block):
+        pcm = (np.clip(block, -1.0, 1.0) * 32767).astype(np.int16)
+        if self.channels > 1:
+            pcm = np.repeat(pcm[:, None], self.channels, axis=1)
+        sound = self.pg.mixer.Sound(buffer=pcm.tobytes())
+        while self.channel.get_queue() is not None: # one block ahead
+            time.sleep(0.001)
+        if self.channel.get_busy():
+            self.channel.queue(sound)
+        else:
+            self.channel.play(sound)
+            
+    def close(self):
+        while self.channel.get_busy():
+            time.sleep(0.01)
+
+# headless sink; optionally paced in real time
+class NullSink():
+    def __init__(self, rate=44.1e3, realtime=False):
+        self.rate = rate
+        self.realtime = realtime
+        self.frames = 0
+        
+    def play(self, block):
+        self.frames += len(block)
+        if self.realtime:
+            time.sleep(len(block) / self.rate)
+            
+    def close(self):
+        pass
+
+# sink by name
+def get_sink(name='pygame', rate=44.1e3):
+    if name == 'null':
+        return NullSink(rate)
+    return Sink(rate)
+
 # main
 def main(args, score, verb=False):
-    init(len(score))
+    if args.bank != None: # memory-mapped once; notes sliced from it
+        import synth
+        bank = synth.Bank(args.bank)
+        init(len(score), rate=bank.rate)
+    else:
+        init(len(score))
     
     # play score one by one
     for note in score:
         if verb: print(note)
-        fname = '{}.wav'.format(note)
-        fname = os.path.join(args.path, fname)
-        th = Thread(target=play_notes, args=(fname, args.duration))
+        if args.bank != None:
+            name = note.rstrip('0123456789')
+            octave = note[len(name):]
+            signal = bank.get(args.sound, name, int(octave)) if octave != '' else None
+            th = Thread(target=play_signal, args=(signal, args.duration))
+        else:
+            fname = '{}.wav'.format(note)
+            fname = os.path.join(args.path, fname)
+            th = Thread(target=play_notes, args=(fname, args.duration))
 
         th.start()
         th.join()